@@ -0,0 +1,299 @@
+""" Offline benchmark for the bot's message dispatch path.
+
+    Drives a :class:`bot.DiscordBot` with fake servers, channels, members and
+    messages, with ``send_message`` stubbed out, and times ``on_message``
+    (command processing plus auto-responses) for every message in a stream.
+
+    Usage::
+
+        python benchmarks/dispatch.py [--messages N] [--replay stream.jsonl]
+                                      [--record stream.jsonl] [--memory]
+
+    Each line of a replayed stream is a json object like::
+
+        {"content": "ping", "author": "101", "channel": "201", "mentions": ["102"]}
+
+    where "author" and "mentions" are member ids, and "channel" is a channel
+    id. Only "content" is required.
+"""
+
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+project_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_dir)
+
+import discord
+
+from extensions import data
+import bot as bot_module
+
+server_count = 3
+channels_per_server = 4
+members_per_server = 20
+bot_user_id = '1'
+
+synthetic_contents = (['ping'] * 5 +
+                      ['help'] * 2 +
+                      ['.8ball will this be fast?'] * 2 +
+                      ['.ping'] +
+                      ['hello everyone', 'lol', 'did anyone see the game last night?',
+                       'brb', 'this message does not match anything at all'] * 4)
+
+class FakeRole(object):
+    def __init__(self, role_id, name):
+        self.id = role_id
+        self.name = name
+
+class FakeServer(object):
+    def __init__(self, server_id, name):
+        self.id = server_id
+        self.name = name
+        self.channels = []
+        self.members = []
+        self.roles = []
+        # commands.when_mentioned looks up the bot's own member
+        self.me = FakeMember(bot_user_id, 'EmberBot', self)
+
+    def get_member(self, member_id):
+        return discord.utils.get(self.members, id=member_id)
+
+class FakeChannel(object):
+    def __init__(self, channel_id, name, server):
+        self.id = channel_id
+        self.name = name
+        self.server = server
+        self.type = discord.ChannelType.text
+        self.is_private = False
+
+    def permissions_for(self, member):
+        return discord.Permissions.general()
+
+class FakeMember(object):
+    def __init__(self, member_id, name, server=None):
+        self.id = member_id
+        self.name = name
+        self.display_name = name
+        self.server = server
+        self.roles = []
+        self.bot = False
+        self.server_permissions = discord.Permissions.none()
+
+    @property
+    def mention(self):
+        return '<@{}>'.format(self.id)
+
+    def __eq__(self, other):
+        return getattr(other, 'id', None) == self.id
+
+    def __hash__(self):
+        return hash(self.id)
+
+class FakeMessage(object):
+    def __init__(self, message_id, content, author, channel, mentions):
+        self.id = message_id
+        self.content = content
+        self.author = author
+        self.channel = channel
+        self.server = channel.server
+        self.mentions = mentions
+        self.channel_mentions = []
+        self.role_mentions = []
+        self.mention_everyone = False
+        self.timestamp = datetime.datetime.utcnow()
+        self.embeds = []
+        self.attachments = []
+        self.tts = False
+
+class World(object):
+    """ The fake servers, channels and members messages are sent in. """
+
+    def __init__(self):
+        self.servers = []
+        self.channels = {}
+        self.members = {}
+        next_id = 100
+        for s in range(server_count):
+            server = FakeServer(str(next_id), 'server {}'.format(s))
+            next_id += 1
+            for c in range(channels_per_server):
+                channel = FakeChannel(str(next_id), 'general' if c == 0 else 'channel-{}'.format(c), server)
+                next_id += 1
+                server.channels.append(channel)
+                self.channels[channel.id] = channel
+            for m in range(members_per_server):
+                member = FakeMember(str(next_id), 'member {}'.format(next_id), server)
+                next_id += 1
+                server.members.append(member)
+                self.members[member.id] = member
+            self.servers.append(server)
+
+    def message(self, message_id, record):
+        channel = self.channels.get(record.get('channel', None), None)
+        if channel is None:
+            channel = self.servers[0].channels[0]
+        author = self.members.get(record.get('author', None), None) or channel.server.members[0]
+        mentions = [self.members[m] for m in record.get('mentions', []) if m in self.members]
+        return FakeMessage(str(message_id), record['content'], author, channel, mentions)
+
+def synthetic_stream(world, count, seed):
+    """ Returns count message records picked at random from common messages. """
+    rng = random.Random(seed)
+    channels = list(world.channels.values())
+    records = []
+    for i in range(count):
+        channel = rng.choice(channels)
+        author = rng.choice(channel.server.members)
+        record = {'content' : rng.choice(synthetic_contents),
+                  'author' : author.id,
+                  'channel' : channel.id}
+        if rng.random() < 0.1:
+            record['mentions'] = [rng.choice(channel.server.members).id]
+        records.append(record)
+    return records
+
+def load_stream(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def make_bot(world):
+    """ Returns a DiscordBot with every extension loaded, that never
+        connects to discord.
+    """
+    bot = bot_module.DiscordBot(bot_module.get_command_prefix, pm_help=False,
+                                default_command_prefix=bot_module.default_command_prefix)
+    bot.connection.user = FakeMember(bot_user_id, 'EmberBot')
+    bot.sent = 0
+
+    @asyncio.coroutine
+    def send_message(destination, content=None, **kwargs):
+        bot.sent += 1
+        return FakeMessage('0', content or '', bot.user, destination, [])
+
+    @asyncio.coroutine
+    def get_json(url, params=None):
+        return {'value' : [{'joke' : 'Chuck Norris wrote this benchmark.'}] * 10}
+
+    bot.send_message = send_message
+    bot.web_client.get_json = get_json
+    bot.outbound.rate = 10 ** 9 # never wait on the fake rate limit
+
+    for extension in ('extensions.core', 'extensions.convenience', 'extensions.fun'):
+        bot.load_extension(extension)
+    return bot
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+def run(bot, world, records, memory=False):
+    """ Dispatches every record through bot.on_message, returning a dict of
+        results.
+    """
+    loop = bot.loop
+    messages = [world.message(i, record) for i, record in enumerate(records)]
+
+    # warm up caches and let background tasks (like joke prefetching) settle
+    for message in messages[:min(len(messages), 50)]:
+        loop.run_until_complete(bot.on_message(message))
+    loop.run_until_complete(asyncio.sleep(0.1, loop=loop))
+
+    sent_before = bot.sent
+    latencies = []
+    peaks = []
+    if memory:
+        tracemalloc.start()
+
+    start = time.perf_counter()
+    for message in messages:
+        if memory:
+            before = tracemalloc.get_traced_memory()[0]
+            if hasattr(tracemalloc, 'reset_peak'):
+                tracemalloc.reset_peak()
+        t0 = time.perf_counter()
+        loop.run_until_complete(bot.on_message(message))
+        latencies.append(time.perf_counter() - t0)
+        if memory:
+            # how far traced memory rose above where it started, at its highest
+            peaks.append(tracemalloc.get_traced_memory()[1] - before)
+    # let the outbound queue finish sending
+    loop.run_until_complete(asyncio.sleep(0, loop=loop))
+    elapsed = time.perf_counter() - start
+
+    if memory:
+        tracemalloc.stop()
+
+    latencies.sort()
+    results = {'messages' : len(messages),
+               'seconds' : elapsed,
+               'messages_per_sec' : len(messages) / elapsed if elapsed else 0.0,
+               'p50_ms' : percentile(latencies, 0.50) * 1000,
+               'p99_ms' : percentile(latencies, 0.99) * 1000,
+               'max_ms' : (latencies[-1] if latencies else 0.0) * 1000,
+               'sends' : bot.sent - sent_before}
+    if memory:
+        results['mean_peak_traced_bytes'] = sum(peaks) / len(peaks) if peaks else 0.0
+    return results
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the bot\'s on_message dispatch path offline.')
+    parser.add_argument('--messages', type=int, default=5000, help='number of synthetic messages')
+    parser.add_argument('--seed', type=int, default=0, help='random seed for synthetic messages')
+    parser.add_argument('--replay', help='jsonl file of messages to replay instead of synthetic ones')
+    parser.add_argument('--record', help='write the message stream used to this jsonl file')
+    parser.add_argument('--memory', action='store_true',
+                        help='also measure the peak traced memory while handling each message (slower)')
+    parser.add_argument('--json', action='store_true', help='print results as json')
+    args = parser.parse_args(argv)
+
+    # keep the bot's real settings out of it
+    temp_dir = tempfile.mkdtemp(prefix='emberbot-bench-')
+    data.json_dir = os.path.join(temp_dir, 'json')
+    data.pickle_dir = os.path.join(temp_dir, 'pickled')
+    os.makedirs(data.json_dir)
+    os.makedirs(data.pickle_dir)
+
+    bot = None
+    try:
+        world = World()
+        if args.replay:
+            records = load_stream(args.replay)
+        else:
+            records = synthetic_stream(world, args.messages, args.seed)
+        if args.record:
+            with open(args.record, 'w', encoding='utf-8') as f:
+                for record in records:
+                    f.write(json.dumps(record) + '\n')
+
+        bot = make_bot(world)
+        results = run(bot, world, records, memory=args.memory)
+    finally:
+        if bot is not None:
+            # write pending saves and close the sessions while temp_dir still exists
+            bot.loop.run_until_complete(bot.logout())
+            bot.data_man.flush()
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        for key, value in results.items():
+            if isinstance(value, float):
+                print('{0:>24}: {1:.3f}'.format(key, value))
+            else:
+                print('{0:>24}: {1}'.format(key, value))
+    return results
+
+if __name__ == '__main__':
+    main()
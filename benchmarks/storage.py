@@ -0,0 +1,114 @@
+""" Benchmark comparing the json storage backends of DataManager.
+
+    Times the same work against one file per document and against the
+    SQLite database, in a temp dir so the bot's real data is left alone:
+
+    - save_json of a whole document with --entries entries
+    - load_json with a cold cache (a fresh backend, like after a restart)
+    - load_json with a warm cache
+    - put_json_key of one entry, --updates times
+    - get_json_key of one entry with a cold cache
+
+    Usage::
+
+        python benchmarks/storage.py [--entries N] [--updates N] [--json]
+"""
+
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+project_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_dir)
+
+from extensions import data
+from extensions.data import FileWriter, JsonFileBackend, SettingsCache, SQLiteBackend
+
+document_name = 'bench/users.json'
+
+def make_document(entries, seed):
+    rng = random.Random(seed)
+    return {str(100000 + i) : {'points' : rng.randint(0, 1000),
+                               'nickname' : 'user{}'.format(i),
+                               'roles' : [rng.randint(0, 20) for _ in range(3)]}
+            for i in range(entries)}
+
+def make_backends(temp_dir):
+    """ Returns a dict of backend name -> function making a fresh backend on
+        the same storage (so its cache starts cold).
+    """
+    json_dir = os.path.join(temp_dir, 'json')
+    os.makedirs(os.path.join(json_dir, os.path.dirname(document_name)))
+    writer = FileWriter()
+    sqlite_path = os.path.join(temp_dir, data.sqlite_filename)
+    return {'files' : lambda: JsonFileBackend(json_dir, SettingsCache(), writer),
+            'sqlite' : lambda: SQLiteBackend(sqlite_path)}
+
+def timed(func, repeat=1):
+    """ Returns the mean seconds func() took over repeat calls. """
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat
+
+def run(make_backend, document, updates, seed):
+    rng = random.Random(seed)
+    keys = list(document)
+    results = {}
+
+    backend = make_backend()
+    results['save_ms'] = timed(lambda: backend.save(document, document_name)) * 1000
+    backend.close()
+
+    cold = make_backend()
+    results['cold_load_ms'] = timed(lambda: cold.load(document_name)) * 1000
+    results['warm_load_ms'] = timed(lambda: cold.load(document_name), repeat=100) * 1000
+    cold.close()
+
+    backend = make_backend()
+    start = time.perf_counter()
+    for i in range(updates):
+        key = rng.choice(keys)
+        backend.put_key(document_name, key, {'points' : i, 'nickname' : key, 'roles' : []})
+    backend.flush()
+    elapsed = time.perf_counter() - start
+    results['put_key_ms'] = elapsed / updates * 1000 if updates else 0.0
+    backend.close()
+
+    cold = make_backend()
+    results['cold_get_key_ms'] = timed(lambda: cold.get_key(document_name, rng.choice(keys))) * 1000
+    cold.close()
+    return results
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compare the json storage backends of DataManager.')
+    parser.add_argument('--entries', type=int, default=10000, help='number of entries in the document')
+    parser.add_argument('--updates', type=int, default=200, help='number of single entry updates')
+    parser.add_argument('--seed', type=int, default=0, help='random seed')
+    parser.add_argument('--json', action='store_true', help='print results as json')
+    args = parser.parse_args(argv)
+
+    document = make_document(args.entries, args.seed)
+    temp_dir = tempfile.mkdtemp(prefix='emberbot-bench-')
+    try:
+        results = {name : run(make_backend, document, args.updates, args.seed)
+                   for name, make_backend in sorted(make_backends(temp_dir).items())}
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        names = sorted(results)
+        print('{0:>18}'.format('') + ''.join('{0:>12}'.format(name) for name in names))
+        for key in results[names[0]]:
+            print('{0:>18}'.format(key) + ''.join('{0:>12.3f}'.format(results[name][key]) for name in names))
+    return results
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,12 @@
+import startup_timing # first, so everything after it is timed
+
 if __name__ == '__main__':
     import dependencies
     dependencies.install() # attempt to isntall any missing dependencies
+    startup_timing.mark('dependencies')
 
 import asyncio
+import functools
 import inspect
 import logging
 import os
@@ -14,29 +18,71 @@ import traceback
 import discord
 from discord.ext import commands
 
-from extensions.core import AutoResponse
+from extensions.cooldowns import CooldownExceeded, CooldownManager
+from extensions.core import AutoResponse, AutoResponseTables, registry as auto_response_registry
+from extensions import data
 from extensions.data import DataManager
-import secret
+from extensions.lazy import LazyExtensions
+from extensions.metrics import metrics
+from extensions.outbound import OutboundQueue
+from extensions.permissions import PermissionCache
+from extensions.scheduler import Interval, JobSpec, Scheduler
+from extensions.watchdog import LoopWatchdog
+from extensions.web import WebClient
+import log_pipeline
 import self_updater
 
+dependencies_filename = 'pip_dependencies.txt'
+
 # set up logger
 log_filename = 'discord.log'
 working_dir = os.path.dirname(os.path.abspath(__file__))
 log_filename = os.path.join(working_dir, log_filename)
 logger = logging.getLogger('discord')
-logger.setLevel(logging.DEBUG)
-handler = logging.FileHandler(filename=log_filename, encoding='utf-8', mode='w')
-handler.setFormatter(logging.Formatter('%(asctime)s:%(levelname)s:%(name)s: %(message)s'))
-logger.addHandler(handler)
+startup_timing.mark('imports')
+
+def setup_logging(filename=log_filename):
+    """ Starts writing the 'discord' logger to filename. Only done when
+        the bot is run, so importing this module writes no files.
+    """
+    return log_pipeline.setup(filename, DataManager())
 
 
 class DiscordBot(commands.Bot):
 
+    data_write_delay_sec = 1 # saves made within this many seconds are written once
+    say_in_all_concurrency = 20 # max number of servers say_in_all sends to at once
+    metrics_dump_interval_sec = 60 # how often metrics are written to metrics_filename
+    metrics_filename = os.path.join(data.data_dir, 'metrics.prom')
+    concurrent_auto_responses = True # if False, matching auto-responses run one at a time
+    auto_response_timeout_sec = 30 # an auto-response running longer is cancelled (None for no limit)
+    statuses_filename = 'game_statuses.json'
+    default_seconds_between_status_changes = 1200
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.default_command_prefix = kwargs.get('default_command_prefix', None)
         self.auto_responses = []
+        self._auto_response_tables = None
+        # modules imported before any extension is, which can not be reloaded
+        self._startup_modules = frozenset(sys.modules)
+        self.lazy_extensions = LazyExtensions.from_file()
+        self.supervisor = None # a shard_supervisor.ShardLink when run by the shard supervisor
+        self.cooldowns = CooldownManager()
+        self.permissions = PermissionCache()
+        self.metrics = metrics
+        self.watchdog = LoopWatchdog(self.loop)
+        self.outbound = OutboundQueue(self)
+        self._announcement_channels = {} # server id -> channel used by say_in_all
+        self.web_client = WebClient(self.loop)
         self.data_man = DataManager()
+        self.data_man.set_write_delay(self.data_write_delay_sec)
+        self._status_config = None # the last loaded statuses data file
+        # started once connected, see on_ready
+        self.scheduler = Scheduler(self.loop)
+        self.scheduler.add('change_status', self.auto_change_status,
+                           Interval(self.default_seconds_between_status_changes), run_now=True)
+        self.scheduler.add('dump_metrics', self.dump_metrics, Interval(self.metrics_dump_interval_sec))
 
     @asyncio.coroutine
     def on_ready(self):
@@ -44,48 +90,62 @@ class DiscordBot(commands.Bot):
         print('Username: ' + self.user.name)
         print('ID: ' + self.user.id)
         print('------')
+
+        self._announcement_channels = {server.id : self._find_announcement_channel(server)
+                                       for server in self.servers}
         
-        self.load_extension('extensions.core')
-        self.load_extension('extensions.convenience')
-        self.load_extension('extensions.fun')
+        startup_timing.mark('connect')
+        self.scheduler.start() # does nothing after reconnecting
+        if self.permissions.admin_config is None:
+            yield from self.permissions.load_admin_config(self.data_man)
+        # on_ready runs again after reconnecting, so only load what is not loaded yet.
+        # Every other extension is loaded the first time a message could use it
+        for name in self.lazy_extensions.eager:
+            if name not in self.extensions:
+                self.load_extension(name)
+        startup_timing.mark('extensions')
+        startup_timing.finish(logger)
 
     @asyncio.coroutine
     def auto_change_status(self):
-        """ A background task that randomly changes the bot's status,
-            or 'presence,' every so often.
-        """
-        statuses_filename = 'game_statuses.json'
-        default_seconds_between_changes = 1200
-
-        yield from self.wait_until_ready()
-
-        while not self.is_closed:
-            potential_games = self.data_man.load_json(statuses_filename)
-            if not potential_games:
-                # create defaults
-                potential_games = {'description' : 'Used for picking a game for bot to play',
-                                   'seconds_between_changes' : default_seconds_between_changes,
-                                   'games' : [
-                                       'Grand Theft Auto V',
-                                       'Wolfenstein',
-                                       'Sid Meier\'s Civilization VI',
-                                       'Dark Souls',
-                                       'Bioshock',
-                                       'Anime Seduction',
-                                       'Mario Kart',
-                                       'A game of chess',
-                                       'with our existence.',
-                                       'with our existence.',
-                                       'with our existence.',
-                                       'with our existence.',
-                                       'Holocaust: A tale of heroes']}
-                self.data_man.save_json(potential_games, statuses_filename)
+        """ A scheduled job that randomly changes the bot's status, or
+            'presence.' The statuses data file is only parsed again when it
+            has changed, which is also when the time between changes is
+            updated.
+        """
+        potential_games = yield from self.data_man.load_json_async(self.statuses_filename)
+        if not potential_games:
+            # create defaults
+            potential_games = {'description' : 'Used for picking a game for bot to play',
+                               'seconds_between_changes' : self.default_seconds_between_status_changes,
+                               'games' : [
+                                   'Grand Theft Auto V',
+                                   'Wolfenstein',
+                                   'Sid Meier\'s Civilization VI',
+                                   'Dark Souls',
+                                   'Bioshock',
+                                   'Anime Seduction',
+                                   'Mario Kart',
+                                   'A game of chess',
+                                   'with our existence.',
+                                   'with our existence.',
+                                   'with our existence.',
+                                   'with our existence.',
+                                   'Holocaust: A tale of heroes']}
+            yield from self.data_man.save_json_async(potential_games, self.statuses_filename)
+            potential_games = yield from self.data_man.load_json_async(self.statuses_filename)
+
+        # loading gives back the same object until the file changes
+        if potential_games is not self._status_config:
+            self._status_config = potential_games
             seconds_between_changes = potential_games.get('seconds_between_changes',
-                                                          default_seconds_between_changes)
+                                                          self.default_seconds_between_status_changes)
+            job = self.scheduler.jobs.get('change_status', None)
+            if job is not None and job.schedule.seconds != seconds_between_changes:
+                self.scheduler.reschedule('change_status', Interval(seconds_between_changes))
 
-            yield from self.change_presence(
-                game=discord.Game(name=random.choice(potential_games.get('games', []))))
-            yield from asyncio.sleep(seconds_between_changes) # task runs every x seconds
+        yield from self.change_presence(
+            game=discord.Game(name=random.choice(potential_games.get('games', []))))
 
     def add_auto_response(self, auto_response):
         """Adds a :class:`extensions.core.AutoResponse` into the internal list
@@ -111,15 +171,191 @@ class DiscordBot(commands.Bot):
             raise discord.ClientException('AutoResponse {0.name} is already registered.'.format(auto_response))
 
         self.auto_responses.append(auto_response)
+        self._auto_response_tables = None # rebuilt on next use
+
+    @property
+    def auto_response_tables(self):
+        """ The :class:`extensions.core.AutoResponseTables` of which
+            registered auto responses are enabled in each server and channel.
+        """
+        if self._auto_response_tables is None:
+            self._auto_response_tables = AutoResponseTables(self.auto_responses)
+        return self._auto_response_tables
+
+    @asyncio.coroutine
+    def reload_auto_responses(self):
+        """ Re-reads the settings of every registered auto response (like
+            after they were edited), and swaps in new dispatch tables.
+
+            The settings are read and the tables made on another thread,
+            without touching the auto responses in use. Both are swapped in
+            on the event loop at once, so a message never sees a mix of old
+            and new settings.
+        """
+        auto_responses = list(self.auto_responses)
+
+        def build():
+            settings = auto_response_registry.read_settings(self.data_man, auto_responses)
+            return settings, AutoResponseTables(auto_responses, settings)
+
+        settings, tables = yield from self.loop.run_in_executor(data.io_executor, build)
+        for auto_response, auto_response_settings in zip(auto_responses, settings):
+            auto_response.apply_settings(auto_response_settings)
+        if auto_responses == self.auto_responses:
+            self._auto_response_tables = tables
+        else:
+            # a cog was added or removed meanwhile, so the tables are stale
+            self._auto_response_tables = None # rebuilt on next use
 
     def add_cog(self, cog):
         super().add_cog(cog)
 
         members = inspect.getmembers(cog)
-        for name, member in members:
-            # register auto-responses the cog has
-            if isinstance(member, AutoResponse):
-                self.add_auto_response(member)
+        cog_auto_responses = [m for name, m in members if isinstance(m, AutoResponse)]
+
+        # read (and save) the settings of all of the cog's auto-responses at once
+        auto_response_registry.resolve(self.data_man, cog_auto_responses)
+        for auto_response in cog_auto_responses:
+            auto_response.instance = cog
+            self.add_auto_response(auto_response)
+
+        for name, job_spec in members:
+            if isinstance(job_spec, JobSpec):
+                self.scheduler.add(job_spec.name, functools.partial(job_spec.callback, cog),
+                                   job_spec.schedule, jitter=job_spec.jitter, owner=cog)
+
+    def remove_cog(self, name):
+        cog = self.cogs.get(name, None)
+        super().remove_cog(name)
+
+        if cog is not None:
+            self.scheduler.cancel_owner(cog)
+            removed = [a for a in self.auto_responses if a.instance is cog]
+            for auto_response in removed:
+                self.auto_responses.remove(auto_response)
+                auto_response_registry.forget(auto_response)
+            if removed:
+                self._auto_response_tables = None # rebuilt on next use
+
+    def plan_update(self, changed_files):
+        """ Works out how to apply changed_files (paths relative to the repo
+            root). Returns a tuple of (list of extensions that can be reloaded,
+            whether a full restart is needed instead).
+
+            Only loaded extensions that nothing imported at startup can be
+            reloaded. Any other python file, or pip_dependencies.txt, changing
+            needs a full restart. Other files are ignored.
+        """
+        to_reload = []
+        restart = False
+        for path in changed_files:
+            path = path.replace('\\', '/')
+            if path.endswith('.py'):
+                module = path[:-len('.py')].replace('/', '.')
+                if module in self.extensions and module not in self._startup_modules:
+                    to_reload.append(module)
+                elif module in self.lazy_extensions.pending and module not in sys.modules:
+                    pass # will be imported fresh on first use
+                else:
+                    restart = True
+            elif os.path.basename(path) == os.path.basename(dependencies_filename):
+                restart = True
+        return to_reload, restart
+
+    @asyncio.coroutine
+    def hot_update(self):
+        """ Pulls updates, and reloads the extensions that changed without
+            disconnecting. Returns the names of the reloaded extensions, or
+            None if a full restart is needed to apply the update (including
+            when an extension fails to load again).
+        """
+        changed = yield from self.loop.run_in_executor(None, self_updater.pull_changes)
+        to_reload, restart = self.plan_update(changed)
+        if restart:
+            return None
+
+        for name in to_reload:
+            logger.info('reloading extension {}'.format(name))
+            self.unload_extension(name)
+            try:
+                self.load_extension(name) # re-registers its auto-responses through add_cog
+            except Exception:
+                logger.exception('failed to reload extension {}, restarting instead'.format(name))
+                # in case the restart does not happen, load it again on first use
+                self.lazy_extensions.pending.add(name)
+                return None
+        return to_reload
+
+    @staticmethod
+    def _find_announcement_channel(server):
+        """ Returns the text channel called 'general' on server (letter case
+            does not matter), or any other text channel if there is none.
+        """
+        fallback = None
+        for channel in server.channels:
+            if channel.type != discord.ChannelType.voice:
+                if channel.name.lower() == 'general':
+                    return channel
+                if fallback is None:
+                    fallback = channel
+        return fallback
+
+    def announcement_channel(self, server):
+        """ Returns the channel that say_in_all uses for server, or None if
+            it has no text channels.
+        """
+        try:
+            return self._announcement_channels[server.id]
+        except KeyError:
+            channel = self._find_announcement_channel(server)
+            self._announcement_channels[server.id] = channel
+            return channel
+
+    def _update_announcement_channel(self, channel):
+        if not channel.is_private:
+            server = channel.server
+            self._announcement_channels[server.id] = self._find_announcement_channel(server)
+
+    @asyncio.coroutine
+    def on_channel_create(self, channel):
+        self._update_announcement_channel(channel)
+
+    @asyncio.coroutine
+    def on_channel_delete(self, channel):
+        self._update_announcement_channel(channel)
+
+    @asyncio.coroutine
+    def on_channel_update(self, before, after):
+        self._update_announcement_channel(after)
+
+    @asyncio.coroutine
+    def on_server_join(self, server):
+        self._announcement_channels[server.id] = self._find_announcement_channel(server)
+
+    @asyncio.coroutine
+    def on_server_remove(self, server):
+        self._announcement_channels.pop(server.id, None)
+        self.permissions.server_removed(server)
+
+    @asyncio.coroutine
+    def on_member_update(self, before, after):
+        self.permissions.member_changed(after)
+
+    @asyncio.coroutine
+    def on_member_remove(self, member):
+        self.permissions.member_changed(member)
+
+    @asyncio.coroutine
+    def on_server_role_create(self, role):
+        self.permissions.roles_changed(role.server)
+
+    @asyncio.coroutine
+    def on_server_role_delete(self, role):
+        self.permissions.roles_changed(role.server)
+
+    @asyncio.coroutine
+    def on_server_role_update(self, before, after):
+        self.permissions.roles_changed(after.server)
 
     @asyncio.coroutine
     def say_in_all(self, *args, **kwargs):
@@ -133,41 +369,159 @@ class DiscordBot(commands.Bot):
             Has a preference towards a text channel called 'general',
             where letter case does not matter.
 
+            Sends to up to say_in_all_concurrency servers at once. Returns a
+            dict of server id to ``None`` if the message was sent, or the
+            exception that stopped it from being sent.
         """
+        semaphore = asyncio.Semaphore(self.say_in_all_concurrency, loop=self.loop)
+
+        @asyncio.coroutine
+        def say_in(channel):
+            with (yield from semaphore):
+                try:
+                    yield from self.queue_message(channel, *args, **kwargs)
+                except Exception as e:
+                    return e
+                return None
+
+        servers = []
+        sends = []
         for server in self.servers:
-            done_one_channel = False
-            # look for text channel with name 'general'
-            for channel in server.channels:
-                if done_one_channel:
-                    break
-                if channel.type != discord.ChannelType.voice and channel.name.lower() == 'general':
-                    yield from self.send_message(channel, *args, **kwargs)
-                    done_one_channel = True
-            # look for any other text channel
-            for channel in server.channels:
-                if done_one_channel:
-                    break
-                if channel.type != discord.ChannelType.voice:
-                    yield from self.send_message(channel, *args, **kwargs)
-                    done_one_channel = True
+            channel = self.announcement_channel(server)
+            if channel is not None:
+                servers.append(server)
+                sends.append(say_in(channel))
+
+        results = yield from asyncio.gather(*sends, loop=self.loop)
+        failures = sum(1 for result in results if result is not None)
+        if failures:
+            logger.warning('say_in_all failed in {0} of {1} servers'.format(failures, len(results)))
+        return {server.id : result for server, result in zip(servers, results)}
+
+    @asyncio.coroutine
+    def send_message(self, destination, content=None, **kwargs):
+        """ Sends a message like :meth:`discord.Client.send_message`,
+            timing it under the 'send' kind of :attr:`metrics`.
+        """
+        with self.metrics.timer('send', 'send_message'):
+            return (yield from super().send_message(destination, content, **kwargs))
+
+    def queue_message(self, destination, content=None, **kwargs):
+        """ Queues a message in :attr:`outbound`, taking the same arguments
+            as :meth:`send_message`. Consecutive text messages to the same
+            channel may be merged into one.
+
+            Returns a future with the sent message. It does not need to be
+            waited on, unless the caller needs the message to be sent before
+            doing something else.
+        """
+        return self.outbound.send(destination, content, **kwargs)
 
     @asyncio.coroutine
     def process_auto_responses(self, message):
-        """ This function sorts through all auto-responses that have been
-            registered, and runs all that are enabled.
+        """ This function finds the registered auto-responses that are
+            enabled where the message was sent and whose triggers could match
+            it, and runs all of them that are not on cooldown.
         """
         if message.author != self.user: # make sure bot didn't say it
-            auto_rsp_json = self.data_man.load_json(AutoResponse.saveFile)
-            for auto_response in self.auto_responses:
-                this_json = auto_rsp_json.get(auto_response.name, None)
-                if this_json:
-                    if this_json.get('enabled', False):
-                        yield from auto_response.callback(self, self, message)
+            candidates = self.auto_response_tables.candidates(message)
+            if not candidates:
+                return
+            enabled = [a for a in candidates if self.cooldowns.try_acquire(a.name, a.cooldown, message)]
+
+            if self.concurrent_auto_responses and len(enabled) > 1:
+                yield from asyncio.gather(*[self._run_auto_response(a, message) for a in enabled],
+                                          loop=self.loop)
+            else:
+                for auto_response in enabled:
+                    yield from self._run_auto_response(auto_response, message)
+
+    @asyncio.coroutine
+    def _run_auto_response(self, auto_response, message):
+        """ Runs one auto-response, cancelling it after
+            auto_response_timeout_sec. Logs and ignores any errors, so that
+            one auto-response can never stop another one from running.
+        """
+        try:
+            instance = auto_response.instance if auto_response.instance is not None else self
+            with self.metrics.timer('auto_response', auto_response.name):
+                yield from asyncio.wait_for(auto_response.callback(instance, self, message),
+                                            self.auto_response_timeout_sec, loop=self.loop)
+        except asyncio.TimeoutError:
+            logger.warning('Auto-response {0} timed out after {1} seconds'.format(
+                auto_response.name, self.auto_response_timeout_sec))
+        except Exception as e:
+            logger.error('Ignoring exception in auto-response {}'.format(auto_response.name))
+            print('Ignoring exception in auto-response {}'.format(auto_response.name), file=sys.stderr)
+            traceback.print_exception(type(e), e, e.__traceback__, file=sys.stderr)
+
+    def load_lazy_extension(self, name):
+        """ Loads an extension listed in the lazy extension manifest, if it
+            is not loaded already.
+        """
+        if name not in self.extensions:
+            logger.info('loading extension {} on first use'.format(name))
+            self.load_extension(name)
+            missing = sorted(command_name for command_name, command in self.commands.items()
+                             if command.callback.__module__ == name
+                             and command_name not in self.lazy_extensions.commands)
+            if missing:
+                logger.warning('{0} has commands missing from extensions/manifest.json: {1}'.format(
+                    name, ', '.join(missing)))
+        self.lazy_extensions.loaded(name)
+
+    @asyncio.coroutine
+    def _load_needed_extensions(self, message):
+        """ Loads every lazy extension message could use. """
+        if not self.lazy_extensions.pending:
+            return
+
+        invoked_with = None
+        prefixes = yield from self._get_prefix(message)
+        if isinstance(prefixes, str):
+            prefixes = (prefixes,)
+        for prefix in prefixes:
+            if message.content.startswith(prefix):
+                words = message.content[len(prefix):].split(None, 1)
+                invoked_with = words[0] if words else None
+                break
+
+        for name in self.lazy_extensions.needed_for(message, invoked_with):
+            self.load_lazy_extension(name)
 
     @asyncio.coroutine
     def on_message(self, message):
-        yield from self.process_commands(message)
-        yield from self.process_auto_responses(message)
+        if message.author != self.user:
+            yield from self._load_needed_extensions(message)
+        # auto-responses do not have to wait for commands to finish
+        yield from asyncio.gather(self.process_commands(message),
+                                  self.process_auto_responses(message),
+                                  loop=self.loop)
+
+    def dispatch(self, event, *args, **kwargs):
+        """ Times commands from their 'command' event until their
+            'command_completion' or 'command_error' event, then dispatches
+            the event as usual.
+        """
+        if event == 'command':
+            ctx = args[1]
+            ctx.metrics_start = time.perf_counter()
+        elif event == 'command_completion' or event == 'command_error':
+            ctx = args[1]
+            start = getattr(ctx, 'metrics_start', None)
+            if start is not None and ctx.command is not None:
+                self.metrics.observe('command', ctx.command.qualified_name,
+                                     time.perf_counter() - start, error=(event == 'command_error'))
+        super().dispatch(event, *args, **kwargs)
+
+    @asyncio.coroutine
+    def dump_metrics(self):
+        """ A scheduled job that writes all metrics to metrics_filename in
+            the Prometheus text format.
+        """
+        text = self.metrics.prometheus_text()
+        yield from self.loop.run_in_executor(data.io_executor, data.atomic_write,
+                                             self.metrics_filename, text.encode('utf-8'))
 
     @asyncio.coroutine
     def on_command_error(self, exception, context):
@@ -180,11 +534,25 @@ class DiscordBot(commands.Bot):
         elif type(exception) == commands.errors.MissingRequiredArgument:
             yield from self.send_message(context.message.channel,
                 'Missing required argument. Please see \'help\'.')
+        elif type(exception) == CooldownExceeded:
+            # replying would defeat the point of the cooldown
+            logger.debug(str(exception))
         else:
             logger.error('Ignoring exception in command {}'.format(context.command))
             print('Ignoring exception in command {}'.format(context.command), file=sys.stderr)
             traceback.print_exception(type(exception), exception, exception.__traceback__, file=sys.stderr)
 
+    @asyncio.coroutine
+    def logout(self):
+        """ Logs out of Discord, closes :attr:`web_client`\, then writes any
+            data files that still have pending saves.
+        """
+        self.watchdog.stop()
+        self.scheduler.stop()
+        yield from super().logout()
+        yield from self.web_client.close()
+        yield from self.data_man.flush_async()
+
     def _restart(self):
         """ Restarts after event loop has ended, and checks for updates """
         seconds_before_restart = 5
@@ -219,6 +587,7 @@ class DiscordBot(commands.Bot):
         except SystemExit:
             restart = False
         finally:
+            self.data_man.flush() # os.execl skips atexit, so flush here
             self.loop.close()
             if restart:
                 self._restart()
@@ -231,8 +600,13 @@ def get_command_prefix(bot, message):
 
 default_command_prefix = '.'
 
+description = ''' A bot to fulfill your wildest dreams. '''
+
 if __name__ == '__main__':
-    description = ''' A bot to fulfill your wildest dreams. '''
+    import secret # only needed to connect, so bot.py can be imported without it
+
+    setup_logging()
     bot = DiscordBot(get_command_prefix, description=description, pm_help=False, default_command_prefix=default_command_prefix)
-    bot.loop.create_task(bot.auto_change_status())
+    startup_timing.mark('bot init')
+    bot.loop.create_task(bot.watchdog.run())
     bot.run(secret.botToken)
\ No newline at end of file
@@ -1,27 +1,100 @@
+import hashlib
 import os
-import pip
+import subprocess
+import sys
 
 pipDependencyFilename = 'pip_dependencies.txt'
+stampFilename = '.pip_dependencies.stamp' # hash of the requirements last installed successfully
 
 working_dir = os.path.dirname(os.path.abspath(__file__))
 pipDependencyFilename = os.path.join(working_dir, pipDependencyFilename)
+stampFilename = os.path.join(working_dir, stampFilename)
 
 def install():
-    """ Installs any missing dependencies using pip """
+    """ Installs any missing dependencies using pip.
+
+        Does nothing if pip_dependencies.txt has not changed since the last
+        successful install. Otherwise only the packages that are not
+        installed (or do not match their version specifier) are installed,
+        all in a single pip invocation.
+    """
     dependencies = get_pip_dependencies()
+    if not dependencies:
+        return
+
+    digest = get_requirements_hash()
+    if digest is not None and digest == read_stamp():
+        return
 
-    if dependencies:
-        for package in dependencies:
-            try:
-                pip.main(['install', package])
-            except:
-                pass
+    missing = [package for package in dependencies if not is_installed(package)]
+    if missing:
+        try:
+            subprocess.check_call([sys.executable, '-m', 'pip', 'install'] + missing)
+        except (OSError, subprocess.CalledProcessError):
+            return # try again next start
+
+    if digest is not None:
+        write_stamp(digest)
 
 def get_pip_dependencies():
     """ Returns a list of pip modules to install """
 
     try:
         with open(pipDependencyFilename, 'r') as f:
-            return f.readlines()
+            lines = (line.split('#', 1)[0].strip() for line in f.readlines())
+            return [line for line in lines if line]
     except (FileNotFoundError, EOFError):
         return None
+
+def get_requirements_hash():
+    """ Returns the sha256 hex digest of pip_dependencies.txt, or None if it
+        does not exist.
+    """
+    try:
+        with open(pipDependencyFilename, 'rb') as f:
+            return hashlib.sha256(f.read()).hexdigest()
+    except FileNotFoundError:
+        return None
+
+def read_stamp():
+    try:
+        with open(stampFilename, 'r') as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        return None
+
+def write_stamp(digest):
+    with open(stampFilename, 'w') as f:
+        f.write(digest)
+
+def is_installed(requirement):
+    """ Returns True if an installed distribution satisfies requirement
+        (a line from pip_dependencies.txt).
+    """
+    try:
+        import pkg_resources
+    except ImportError:
+        pkg_resources = None
+
+    if pkg_resources is not None:
+        try:
+            pkg_resources.require(requirement)
+            return True
+        except (pkg_resources.DistributionNotFound, pkg_resources.VersionConflict):
+            return False
+        except Exception:
+            return False # could not parse it, let pip decide
+
+    # no setuptools, so only check that something with this name is installed
+    try:
+        import importlib.metadata # python 3.8+
+    except ImportError:
+        return False # can not tell, let pip decide
+    name = requirement
+    for separator in '<>=!~;[ ':
+        name = name.split(separator, 1)[0]
+    try:
+        importlib.metadata.version(name)
+        return True
+    except importlib.metadata.PackageNotFoundError:
+        return False
@@ -7,4 +7,4 @@ A module holding commands and auto-response functions
 for a discord bot.
 """
 
-__all__ = ['core', 'data', 'convenience', 'fun']
\ No newline at end of file
+__all__ = ['core', 'cooldowns', 'data', 'lazy', 'linked_accounts', 'logstore', 'metrics', 'outbound', 'permissions', 'scheduler', 'sqlite_store', 'watchdog', 'web', 'convenience', 'fun']
\ No newline at end of file
@@ -3,14 +3,39 @@ import asyncio
 import discord
 from discord.ext import commands
 
-from .core import AutoResponse, auto_response
+from .cooldowns import BucketType, Cooldown
+from .core import AutoResponse, Trigger, auto_response, check_is_admin
+from .linked_accounts import LinkedAccounts
+
+accounts_filename = 'linked_accounts.json'
 
 class Convenience(object):
     """ Convenience functions for the bot. """
     def __init__(self, bot):
         self.bot = bot
+        self._linked_accounts = None
+        self._linked_accounts_source = None # the loaded json the index was built from
+
+    def linked_accounts(self, accounts_info):
+        """ Returns the :class:`LinkedAccounts` index for the loaded
+            accounts_info, only rebuilding it if the file has changed.
+        """
+        # DataManager hands back the same cached object until the file changes
+        if accounts_info is not self._linked_accounts_source:
+            self._linked_accounts = LinkedAccounts.from_json(accounts_info)
+            self._linked_accounts_source = accounts_info
+        return self._linked_accounts
 
-    @auto_response()
+    @asyncio.coroutine
+    def _save_linked_accounts(self, accounts_info, linked):
+        """ Saves the groups in linked, and keeps using linked as the index. """
+        data_man = self.bot.data_man
+        yield from data_man.save_json_async(linked.to_json(accounts_info), accounts_filename)
+        self._linked_accounts = linked
+        self._linked_accounts_source = yield from data_man.load_json_async(accounts_filename)
+
+    @auto_response(triggers=[Trigger.exact('help')],
+                   cooldown=Cooldown(1, 30, BucketType.user))
     @asyncio.coroutine
     def help_incorrect(self, bot, message):
         """ For when someone types 'help' without the command prefix. """
@@ -23,34 +48,25 @@ class Convenience(object):
                 message.channel,
                 response.format(prefix))
 
-    @auto_response()
+    @auto_response(triggers=[Trigger.mention()])
     @asyncio.coroutine
     def multi_account_mention(self, bot, message):
         """ A convenience function for users who have two accounts.
             If a user is @mentioned, and has two or more accounts,
             all his/her accounts will be @mentioned.
         """
-        accounts_filename = 'linked_accounts.json'
-
         mention_str = '<@{id}>'
-        output = ''
 
-        accounts_info = bot.data_man.load_json(accounts_filename)
-        member_ids = [m.id for m in message.mentions]
+        accounts_info = yield from bot.data_man.load_json_async(accounts_filename)
 
         if accounts_info:
-            for member_id in member_ids:
-                associated_accounts = accounts_info.get(member_id, None)
-                if associated_accounts: # if member id in dict
-                    for account_id in associated_accounts:
-                        # only mention associated accounts that have not been mentioned already
-                        if account_id not in member_ids:
-                            output += mention_str.format(id=account_id) + ' '
-
-            if output != '':
+            member_ids = {m.id for m in message.mentions}
+            # only mention associated accounts that have not been mentioned already
+            others = self.linked_accounts(accounts_info).others(member_ids)
+            if others:
                 yield from bot.send_message(
                     message.channel,
-                    output)
+                    ' '.join(mention_str.format(id=account_id) for account_id in others))
         else:
             accounts_info = {'description' :
                                 'Use this file to link accounts.' +
@@ -78,7 +94,50 @@ class Convenience(object):
                                     '<insert account id 2 here>'
                                 ]
                             }
-            bot.data_man.save_json(accounts_info, accounts_filename)
+            yield from bot.data_man.save_json_async(accounts_info, accounts_filename)
+
+    @commands.group(pass_context=True, brief='Please see \'help accounts\' for more info.')
+    @asyncio.coroutine
+    def accounts(self, ctx):
+        """ A group of commands for linking accounts that belong to the same
+            person, used by the multi_account_mention auto-response.
+        """
+        if not ctx.invoked_subcommand:
+            response = 'Please use \"{prefix}help accounts\" for a list of commands.'
+            yield from self.bot.say(response.format(prefix=ctx.prefix))
+
+    @accounts.command(pass_context=True, name='link')
+    @check_is_admin()
+    @asyncio.coroutine
+    def _link(self, ctx, member : discord.Member, other : discord.Member):
+        """ Use 'accounts link @<account> @<other account>'.
+
+            Links two accounts, so mentioning one also mentions the other
+            (and every account already linked to either of them).
+        """
+        accounts_info = yield from self.bot.data_man.load_json_async(accounts_filename)
+        accounts_info = accounts_info or {}
+        linked = self.linked_accounts(accounts_info)
+        linked.link(member.id, other.id)
+        yield from self._save_linked_accounts(accounts_info, linked)
+        yield from self.bot.say('Linked {0} to {1}.'.format(member.name, ', '.join(
+            sorted(m for m in linked.group(member.id) if m != member.id))))
+
+    @accounts.command(pass_context=True, name='unlink')
+    @check_is_admin()
+    @asyncio.coroutine
+    def _unlink(self, ctx, member : discord.Member):
+        """ Use 'accounts unlink @<account>'.
+
+            Unlinks an account from every account it is linked to.
+        """
+        accounts_info = yield from self.bot.data_man.load_json_async(accounts_filename)
+        if not accounts_info or not self.linked_accounts(accounts_info).group(member.id):
+            yield from self.bot.say('{0} is not linked to any accounts.'.format(member.name))
+            return
+        linked = self.linked_accounts(accounts_info).without(member.id)
+        yield from self._save_linked_accounts(accounts_info, linked)
+        yield from self.bot.say('Unlinked {0}.'.format(member.name))
 
     @commands.command(pass_context=True, hidden=True)
     @asyncio.coroutine
@@ -97,18 +156,19 @@ class Convenience(object):
             return
 
         # Find out what server to say in
-        yield from self.bot.send_message(ctx.message.channel, 'Servers')
-        yield from self.bot.send_message(ctx.message.channel, '-------')
+        # (queued lines to the same channel are merged into as few messages as possible)
+        self.bot.queue_message(ctx.message.channel, 'Servers')
+        self.bot.queue_message(ctx.message.channel, '-------')
         i = 1
         while i < len(server_list) + 1:
-            yield from self.bot.send_message(ctx.message.channel,
+            self.bot.queue_message(ctx.message.channel,
                 '{num}. {server}'.format(num=i, server=server_list[i-1].name))
             i += 1
-        yield from self.bot.send_message(ctx.message.channel, '-------')
+        self.bot.queue_message(ctx.message.channel, '-------')
 
         server = None
         while not server:
-            yield from self.bot.send_message(ctx.message.channel,
+            yield from self.bot.queue_message(ctx.message.channel,
                 'Please enter in a number for the server you want')
             message = yield from self.bot.wait_for_message(timeout=normal_rsp_timeout_sec,
                                                            channel=ctx.message.channel,
@@ -132,18 +192,18 @@ class Convenience(object):
             if c.type != discord.ChannelType.voice:
                 channel_list.append(c)
 
-        yield from self.bot.send_message(ctx.message.channel, 'Channels')
-        yield from self.bot.send_message(ctx.message.channel, '-------')
+        self.bot.queue_message(ctx.message.channel, 'Channels')
+        self.bot.queue_message(ctx.message.channel, '-------')
         i = 1
         while i < len(channel_list) + 1:
-            yield from self.bot.send_message(ctx.message.channel,
+            self.bot.queue_message(ctx.message.channel,
                 '{num}. {channel}'.format(num=i, channel=channel_list[i-1].name))
             i += 1
-        yield from self.bot.send_message(ctx.message.channel, '-------')
+        self.bot.queue_message(ctx.message.channel, '-------')
 
         channel = None
         while not channel:
-            yield from self.bot.send_message(ctx.message.channel,
+            yield from self.bot.queue_message(ctx.message.channel,
                 'Please enter in a number for the channel you want')
             message = yield from self.bot.wait_for_message(timeout=normal_rsp_timeout_sec,
                                                            channel=ctx.message.channel,
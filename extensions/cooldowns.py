@@ -0,0 +1,201 @@
+import collections
+import logging
+import time
+
+from discord.ext import commands
+
+from .metrics import metrics
+
+logger = logging.getLogger('discord')
+
+class BucketType(object):
+    """ What a cooldown is counted per. """
+    default = 'global' # one bucket shared by everyone
+    user = 'user'
+    channel = 'channel'
+    server = 'server'
+
+    all = (default, user, channel, server)
+
+class CooldownExceeded(commands.CheckFailure):
+    """ Raised by a :func:`cooldown` check when a command is used too often. """
+
+    def __init__(self, name, retry_after):
+        self.name = name
+        self.retry_after = retry_after
+        super().__init__('{0} is on cooldown, retry in {1:.1f}s'.format(name, retry_after))
+
+class Cooldown(object):
+    """ Allows ``rate`` uses every ``per`` seconds, counted per ``bucket``.
+
+        Attributes
+        -----------
+        rate : int
+            The number of uses allowed in a burst.
+        per : float
+            The number of seconds it takes to get all uses back.
+        bucket : str
+            One of the :class:`BucketType` values.
+    """
+
+    __slots__ = ('rate', 'per', 'bucket')
+
+    def __init__(self, rate, per, bucket=BucketType.user):
+        if bucket not in BucketType.all:
+            raise ValueError('Unknown cooldown bucket type {}'.format(bucket))
+        if rate < 1:
+            raise ValueError('Cooldown rate must be at least 1, not {}'.format(rate))
+        if not per > 0:
+            raise ValueError('Cooldown per must be more than 0, not {}'.format(per))
+        self.rate = rate
+        self.per = per
+        self.bucket = bucket
+
+    @classmethod
+    def from_json(cls, json_dict, default=None):
+        """ Makes a Cooldown from a dict like the one from :attr:`json_dict`.
+            Returns None if json_dict is empty, and logs and returns default
+            if it is invalid (like a rate below 1 or a per of 0).
+        """
+        if not json_dict:
+            return None
+        try:
+            return cls(int(json_dict['rate']), float(json_dict['per']),
+                       json_dict.get('bucket', BucketType.user))
+        except (KeyError, TypeError, ValueError, AttributeError) as e:
+            logger.warning('Ignoring invalid cooldown {0!r}: {1!r}'.format(json_dict, e))
+            return default
+
+    @property
+    def json_dict(self):
+        return {'rate' : self.rate,
+                'per' : self.per,
+                'bucket' : self.bucket}
+
+def _bucket_key(bucket, message):
+    if bucket == BucketType.user:
+        return message.author.id
+    elif bucket == BucketType.channel:
+        return message.channel.id
+    elif bucket == BucketType.server:
+        # private messages have no server, so count them per channel
+        return message.server.id if message.server is not None else message.channel.id
+    return None
+
+class CooldownManager(object):
+    """ Token buckets for every cooldown in use by the bot.
+
+        Each bucket is a two item list of [tokens, last update time], stored
+        only while it is not full. Tokens are refilled lazily when a bucket
+        is used, and full buckets are dropped every sweep_interval seconds.
+
+        Attributes
+        -----------
+        allowed : collections.Counter
+            The number of allowed uses, by name.
+        suppressed : collections.Counter
+            The number of uses that were blocked by a cooldown, by name.
+
+        Both are also recorded under the 'cooldown' kind of
+        :data:`extensions.metrics.metrics`, as calls with suppressed uses
+        counted as errors, so they show up in 'stats' and metrics.prom.
+    """
+
+    sweep_interval = 60 # seconds between removing buckets that have refilled
+
+    def __init__(self, clock=time.monotonic):
+        self.allowed = collections.Counter()
+        self.suppressed = collections.Counter()
+        self._clock = clock
+        self._buckets = {} # (name, bucket key) -> [tokens, updated]
+        self._pers = {} # name -> longest per seen, used for sweeping
+        self._last_sweep = clock()
+
+    def try_acquire(self, name, cooldown, message):
+        """ Uses one token from the bucket for name and message. Returns
+            ``True`` if the use is allowed, and ``False`` if it is on cooldown.
+            Always returns ``True`` if cooldown is None.
+        """
+        if cooldown is None:
+            return True
+        return self.retry_after(name, cooldown, message, consume=True) == 0
+
+    def retry_after(self, name, cooldown, message, consume=False):
+        """ Returns the number of seconds until the next use is allowed, or
+            0 if it is allowed now. If consume is ``True``\, an allowed use
+            takes a token and a blocked use is counted as suppressed.
+        """
+        now = self._clock()
+        if now - self._last_sweep >= self.sweep_interval:
+            self._sweep(now)
+
+        key = (name, _bucket_key(cooldown.bucket, message))
+        bucket = self._buckets.get(key, None)
+        if bucket is None:
+            tokens = cooldown.rate
+        else:
+            refill = (now - bucket[1]) * cooldown.rate / cooldown.per
+            tokens = min(cooldown.rate, bucket[0] + refill)
+
+        if tokens >= 1:
+            if consume:
+                self._buckets[key] = [tokens - 1, now]
+                self._pers[name] = max(self._pers.get(name, 0), cooldown.per)
+                self.allowed[name] += 1
+                metrics.observe('cooldown', name, 0)
+            return 0
+
+        if consume:
+            self.suppressed[name] += 1
+            metrics.observe('cooldown', name, 0, error=True)
+        return (1 - tokens) * cooldown.per / cooldown.rate
+
+    def _sweep(self, now):
+        """ Drops buckets that have had time to refill completely. """
+        self._last_sweep = now
+        stale = [key for key, bucket in self._buckets.items()
+                 if now - bucket[1] >= self._pers.get(key[0], 0)]
+        for key in stale:
+            del self._buckets[key]
+
+    def reset(self, name=None):
+        """ Clears the buckets for name, or all buckets if name is None. """
+        if name is None:
+            self._buckets.clear()
+        else:
+            for key in [k for k in self._buckets if k[0] == name]:
+                del self._buckets[key]
+
+    @property
+    def stats(self):
+        return {'buckets' : len(self._buckets),
+                'allowed' : dict(self.allowed),
+                'suppressed' : dict(self.suppressed)}
+
+def cooldown(rate, per, bucket=BucketType.user):
+    """ A decorator that puts a command on a :class:`Cooldown` tracked by the
+        bot's :class:`CooldownManager`. Raises :class:`CooldownExceeded`
+        when the command is used too often.
+
+        A use is only counted when the command itself is being invoked, not
+        when its checks are run for another command (like by 'help' to see
+        which commands can be listed).
+    """
+    command_cooldown = Cooldown(rate, per, bucket)
+
+    def decorator(func):
+        callback = func.callback if isinstance(func, commands.Command) else func
+
+        def predicate(ctx):
+            command = ctx.command
+            if command is None or command.callback is not callback:
+                return True
+            name = command.qualified_name
+            retry_after = ctx.bot.cooldowns.retry_after(name, command_cooldown, ctx.message, consume=True)
+            if retry_after:
+                raise CooldownExceeded(name, retry_after)
+            return True
+
+        return commands.check(predicate)(func)
+
+    return decorator
@@ -1,55 +1,306 @@
 import asyncio
+import collections
+import cProfile
 import copy
-import functools
 import inspect
+import io
 import json
 import logging
+import os
+import pstats
+import time
 
-import discord
 from discord.ext import commands
 
-from .data import DataManager
+from . import data
+from .cooldowns import Cooldown
+from .permissions import admin_filename
 
 def check_is_admin():
-    """ A decorator that checks if a given command was run by an 'admin' """
-    def predicate(ctx):
-        # only one of these role names or perms is needed to be 'admin'
-        admin_role_names = ('Admin', 'Moderator', 'bot_admin')
-        admin_role_perms = {'administrator' : True}
+    """ A decorator that checks if a given command was run by an 'admin'.
 
+        Who counts as an admin is set per server in the admin roles data
+        file, which the bot's :class:`extensions.permissions.PermissionCache`
+        keeps in memory along with the results.
+    """
+    def predicate(ctx):
         msg = ctx.message
-        ch = msg.channel
-        if ch.is_private:
+        if msg.channel.is_private:
             return False
-
-        permissions = ch.permissions_for(msg.author)
-
-        role_getter = functools.partial(discord.utils.get, msg.author.roles)
-        has_role = any(role_getter(name=name) is not None for name in admin_role_names)
-        has_perms = all(getattr(permissions, perm, None) == value for perm, value in admin_role_perms.items())
-        return has_role or has_perms
+        return ctx.bot.permissions.is_admin(msg.author)
 
     return commands.check(predicate)
 
+profile_dir = os.path.join(data.data_dir, 'profiles')
+
 class Core():
     """ Filled with core commands for the bot. """
 
+    max_profile_sec = 120
+    profile_top_functions = 25
+
     def __init__(self, bot):
         self.bot = bot
         self.data_man = bot.data_man
         self.logger = logging.getLogger('discord')
+        self._profiling = False
 
-    @commands.command(aliases=['restart'], help='Restarts bot and checks for updates.')
+    @commands.command(pass_context=True, aliases=['restart'], help='Checks for updates, and restarts if needed.')
     @asyncio.coroutine
-    def update(self):
-        """  Stops event loop and client by logging the bot out.
-        After the event loop ends, the bot will check for
-        updates and restart this script.
+    def update(self, ctx):
+        """ Pulls updates, and reloads just the extensions that changed
+        while staying connected. If anything else changed (or 'restart' was
+        used), stops event loop and client by logging the bot out. After
+        the event loop ends, the bot will check for updates and restart
+        this script.
         """
-        self.logger.debug('attempting restart')
+        if self.bot.supervisor is not None:
+            # all shards are restarted one at a time by the shard supervisor
+            self.bot.supervisor.request_update()
+            yield from self.bot.say('Rolling restart requested.')
+            return
+
+        if ctx.invoked_with != 'restart':
+            reloaded = yield from self.bot.hot_update()
+            if reloaded is not None:
+                if reloaded:
+                    yield from self.bot.say('Reloaded {}.'.format(', '.join(reloaded)))
+                else:
+                    yield from self.bot.say('Already up to date.')
+                return
+
+        self.logger.info('attempting restart')
         yield from self.bot.say_in_all('restarting...')
         yield from self.bot.logout()
 
+    @commands.command(pass_context=True)
+    @asyncio.coroutine
+    def stats(self, ctx, kind : str = None):
+        """ Use 'stats' or 'stats <kind>'.
+
+            Shows how often, how slowly, and how often unsuccessfully
+            commands, auto-responses, data file calls and sends have run,
+            and how often cooldowns were checked and blocked a use (as
+            errors). Kind can be one of 'command', 'auto_response', 'job',
+            'data', 'send' or 'cooldown'.
+        """
+        lines = self.bot.metrics.summary_lines(kind)
+        if not lines:
+            yield from self.bot.say('Nothing has been measured yet.')
+            return
+
+        paginator = commands.Paginator()
+        for line in lines:
+            paginator.add_line(line)
+        yield from asyncio.gather(*[self.bot.queue_message(ctx.message.channel, p) for p in paginator.pages],
+                                  loop=self.bot.loop)
+
+    @commands.command(pass_context=True)
+    @asyncio.coroutine
+    def lag(self, ctx):
+        """ Shows how far behind the bot's event loop is running, and what
+            was blocking it the last time it got stuck.
+        """
+        watchdog = self.bot.watchdog
+        paginator = commands.Paginator()
+        paginator.add_line('last lag: {0:.1f}ms, max lag: {1:.1f}ms, times blocked: {2}'.format(
+            watchdog.last_lag_sec * 1000, watchdog.max_lag_sec * 1000, watchdog.stall_count))
+        if watchdog.stalls:
+            stall = watchdog.stalls[-1]
+            paginator.add_line('last blocked for {0:.3f}s at {1} while running {2}'.format(
+                stall.lag_sec, time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(stall.when)),
+                stall.task or 'an unknown task'))
+            if stall.stack:
+                # the innermost frames are the interesting ones
+                for line in stall.stack.splitlines()[-20:]:
+                    paginator.add_line(line[:1900])
+        yield from asyncio.gather(*[self.bot.queue_message(ctx.message.channel, p) for p in paginator.pages],
+                                  loop=self.bot.loop)
+
+    @commands.command(pass_context=True)
+    @check_is_admin()
+    @asyncio.coroutine
+    def profile(self, ctx, seconds : float = 10):
+        """ Use 'profile <seconds>'.
+
+            Profiles everything the bot does for the given number of seconds
+            (at most 120), then shows the functions that took the most time.
+            The full stats are saved in data/profiles for a closer look with
+            the pstats module.
+
+            WARNING: Only people who the bot recognises as 'admins'
+                     can use this command.
+        """
+        if self._profiling:
+            yield from self.bot.say('Already profiling, please wait for that to finish.')
+            return
+        seconds = max(1, min(seconds, self.max_profile_sec))
+
+        self._profiling = True
+        profiler = cProfile.Profile()
+        try:
+            yield from self.bot.say('Profiling for {0:g} seconds...'.format(seconds))
+            # everything on the event loop runs on this thread, so this
+            # sees every command, auto-response and event handler
+            profiler.enable()
+            try:
+                yield from asyncio.sleep(seconds, loop=self.bot.loop)
+            finally:
+                profiler.disable()
+        finally:
+            self._profiling = False
+
+        filename = 'profile-{}.pstats'.format(time.strftime('%Y%m%d-%H%M%S'))
+        path = os.path.join(profile_dir, filename)
+        yield from self.bot.loop.run_in_executor(data.io_executor, self._save_profile, profiler, path)
+
+        output = io.StringIO()
+        stats = pstats.Stats(profiler, stream=output)
+        stats.sort_stats('cumulative').print_stats(self.profile_top_functions)
+
+        paginator = commands.Paginator()
+        paginator.add_line('Saved full stats to data/profiles/{}'.format(filename))
+        for line in output.getvalue().splitlines():
+            if line.strip():
+                paginator.add_line(line[:1900])
+        yield from asyncio.gather(*[self.bot.queue_message(ctx.message.channel, p) for p in paginator.pages],
+                                  loop=self.bot.loop)
+
+    @staticmethod
+    def _save_profile(profiler, path):
+        if not os.path.exists(profile_dir):
+            os.makedirs(profile_dir)
+        profiler.dump_stats(path)
+
+    @commands.group(pass_context=True, invoke_without_command=True)
+    @asyncio.coroutine
+    def jobs(self, ctx):
+        """ Use 'jobs' or 'jobs cancel <name>'.
+
+            Shows the bot's scheduled background jobs, when they run next,
+            and how long they have taken.
+        """
+        series = {name : s for kind, name, s in self.bot.metrics.snapshot() if kind == 'job'}
+        now = time.time()
+        paginator = commands.Paginator()
+        for job in sorted(self.bot.scheduler.jobs.values(), key=lambda j: j.next_run):
+            s = series.get(job.name, None)
+            mean_ms = s.total_sec / s.calls * 1000 if s is not None and s.calls else 0.0
+            paginator.add_line('{name:<20} {schedule:<18} next in {next:.0f}s{running} runs={runs} '
+                               'skipped={skipped} errors={errors} mean={mean:.1f}ms max={max:.1f}ms'.format(
+                                   name=job.name, schedule=str(job.schedule), next=max(0, job.next_run - now),
+                                   running=' (running)' if job.running else '', runs=job.runs,
+                                   skipped=job.skipped, errors=s.errors if s is not None else 0,
+                                   mean=mean_ms, max=s.max_sec * 1000 if s is not None else 0.0))
+        if not self.bot.scheduler.jobs:
+            paginator.add_line('No jobs are scheduled.')
+        yield from asyncio.gather(*[self.bot.queue_message(ctx.message.channel, p) for p in paginator.pages],
+                                  loop=self.bot.loop)
+
+    @jobs.command(pass_context=True, name='cancel')
+    @check_is_admin()
+    @asyncio.coroutine
+    def _jobs_cancel(self, ctx, name : str):
+        """ Use 'jobs cancel <name>'.
+
+            Stops a job until the bot restarts, or its extension is reloaded.
+        """
+        if self.bot.scheduler.cancel(name):
+            yield from self.bot.say('Cancelled {}.'.format(name))
+        else:
+            yield from self.bot.say('No job called \'{0}\' found. Please use \'jobs\'.'.format(name))
+
+    @commands.group(pass_context=True, name='autoresponse', aliases=['ar'])
+    @asyncio.coroutine
+    def _autoresponse(self, ctx):
+        """ Use 'autoresponse list', or 'autoresponse enable/disable/reset
+            <name> [channel|server|everywhere]'.
+
+            Auto-responses can be turned on or off everywhere, for a whole
+            server, or for single channels. A channel setting wins over a
+            server setting, which wins over the setting for everywhere.
+        """
+        if ctx.invoked_subcommand is None:
+            yield from self.bot.say('Please use \"{prefix}help autoresponse\" for a list of commands.'.format(
+                prefix=ctx.prefix))
+
+    @_autoresponse.command(pass_context=True, name='list')
+    @asyncio.coroutine
+    def _autoresponse_list(self, ctx):
+        """ Shows every auto-response and whether it is on in this channel. """
+        msg = ctx.message
+        server_id = msg.server.id if msg.server is not None else None
+        paginator = commands.Paginator()
+        for auto_rsp in sorted(self.bot.auto_responses, key=lambda a: a.name):
+            enabled = auto_rsp.enabled_in(server_id, msg.channel.id)
+            paginator.add_line('{0} {1} - {2}'.format('+' if enabled else '-', auto_rsp.name,
+                                                      auto_rsp.description)[:1900])
+        yield from asyncio.gather(*[self.bot.queue_message(msg.channel, p) for p in paginator.pages],
+                                  loop=self.bot.loop)
+
+    @_autoresponse.command(pass_context=True, name='enable')
+    @check_is_admin()
+    @asyncio.coroutine
+    def _autoresponse_enable(self, ctx, name : str, scope : str = 'channel'):
+        """ Use 'autoresponse enable <name> [channel|server|everywhere]'. """
+        yield from self._set_auto_response(ctx, name, scope, True)
+
+    @_autoresponse.command(pass_context=True, name='disable')
+    @check_is_admin()
+    @asyncio.coroutine
+    def _autoresponse_disable(self, ctx, name : str, scope : str = 'channel'):
+        """ Use 'autoresponse disable <name> [channel|server|everywhere]'. """
+        yield from self._set_auto_response(ctx, name, scope, False)
+
+    @_autoresponse.command(pass_context=True, name='reset')
+    @check_is_admin()
+    @asyncio.coroutine
+    def _autoresponse_reset(self, ctx, name : str, scope : str = 'channel'):
+        """ Use 'autoresponse reset <name> [channel|server]'.
+
+            Removes the channel or server setting, so the next wider one
+            is used again.
+        """
+        yield from self._set_auto_response(ctx, name, scope, None)
+
+    @asyncio.coroutine
+    def _set_auto_response(self, ctx, name, scope, enabled):
+        msg = ctx.message
+        auto_rsp = next((a for a in self.bot.auto_responses if a.name == name), None)
+        if auto_rsp is None:
+            yield from self.bot.say('No auto-response called \'{0}\' found. Please use \'autoresponse list\'.'.format(name))
+            return
+        if scope not in ('channel', 'server', 'everywhere') or (scope == 'everywhere' and enabled is None):
+            yield from self.bot.say('Scope must be one of \'channel\', \'server\' or \'everywhere\'.')
+            return
+
+        auto_rsp_json = yield from self.data_man.load_json_async(AutoResponse.saveFile)
+        # deep copy, since loaded objects are shared with the DataManager cache
+        auto_rsp_json = copy.deepcopy(auto_rsp_json) if auto_rsp_json else {}
+        this_json = auto_rsp_json.setdefault(name, copy.deepcopy(auto_rsp.json_dict))
+        if scope == 'everywhere':
+            this_json['enabled'] = enabled
+        else:
+            server = this_json.setdefault('servers', {}).setdefault(msg.server.id, {})
+            if scope == 'server':
+                key, settings = 'enabled', server
+            else:
+                key, settings = msg.channel.id, server.setdefault('channels', {})
+            if enabled is None:
+                settings.pop(key, None)
+            else:
+                settings[key] = enabled
+            # leave out settings that no longer say anything
+            if not server.get('channels', True):
+                del server['channels']
+            if not server:
+                del this_json['servers'][msg.server.id]
+
+        yield from self.data_man.save_json_async(auto_rsp_json, AutoResponse.saveFile)
+        yield from self.bot.reload_auto_responses()
+        yield from self.bot.say('{0} is now {1} in this channel.'.format(
+            name, 'on' if auto_rsp.enabled_in(msg.server.id, msg.channel.id) else 'off'))
+
     @commands.group(pass_context=True, brief='Please see \'help settings\' for more info.')
     @asyncio.coroutine
     def settings(self, ctx):
@@ -65,14 +316,15 @@ class Core():
         """ Displays a list of editable settings. """
         paginator = commands.Paginator()
 
-        for dirpath, dirnames, filenames in self.data_man.walk_json():
+        walked = yield from self.data_man.walk_json_async()
+        for dirpath, dirnames, filenames in walked:
             for filename in filenames:
                 no_ext = filename.split('.')[0] # remove filename extension
                 paginator.add_line(line='-- \'{0}\''.format(no_ext))
         
         pages = paginator.pages
-        for p in pages:
-            yield from self.bot.say(p)
+        yield from asyncio.gather(*[self.bot.queue_message(ctx.message.channel, p) for p in pages],
+                                  loop=self.bot.loop)
 
     @settings.command(pass_context=True, name='edit')
     #@check_is_admin()
@@ -90,7 +342,7 @@ class Core():
         edit_timeout_sec = 120
 
         filename = setting + '.json'
-        setting_obj = self.data_man.load_json(filename)
+        setting_obj = yield from self.data_man.load_json_async(filename)
         if not setting_obj:
             yield from self.bot.say('No setting called \'{0}\' found. Please use \'settings list\'.'.format(setting))
         else:
@@ -106,10 +358,10 @@ class Core():
             paginator.close_page()
             paginator.add_line(setting_json)
             for p in paginator.pages:
-                yield from self.bot.send_message(channel, p)
+                self.bot.queue_message(channel, p)
 
             done_waiting_for_rsp = False
-            yield from self.bot.send_message(channel, 'Is this the file you want to edit? [Y/N]?')
+            yield from self.bot.queue_message(channel, 'Is this the file you want to edit? [Y/N]?')
             while not done_waiting_for_rsp:
                 message = yield from self.bot.wait_for_message(timeout=normal_rsp_timeout_sec,
                                                                channel=channel)
@@ -163,7 +415,11 @@ class Core():
                             del message
                             continue
                         if json_obj:
-                            self.bot.data_man.save_json(json_obj, filename)
+                            yield from self.bot.data_man.save_json_async(json_obj, filename)
+                            if filename == AutoResponse.saveFile:
+                                yield from self.bot.reload_auto_responses()
+                            elif filename == admin_filename:
+                                yield from self.bot.permissions.load_admin_config(self.data_man)
                             yield from self.bot.send_message(channel,
                                 'Settings have been updated! Exiting command now...')
                             yield from self.bot.send_message(channel,
@@ -178,6 +434,188 @@ def setup(bot):
     """ Allows this module to be added as an 'extension' to the bot. """
     bot.add_cog(Core(bot))
 
+class Trigger(object):
+    """ Describes which messages an :class:`AutoResponse` can respond to.
+        Text is compared against the lower-case message content.
+
+        Use one of the class methods to make one, eg. ``Trigger.exact('ping')``.
+
+        Attributes
+        -----------
+        kind : str
+            One of 'exact', 'prefix', 'mention' or 'any'.
+        text : str
+            The lower-case text for 'exact' and 'prefix' triggers, or None.
+    """
+
+    EXACT = 'exact'
+    PREFIX = 'prefix'
+    MENTION = 'mention'
+    ANY = 'any'
+
+    def __init__(self, kind, text=None):
+        self.kind = kind
+        self.text = text.lower() if text is not None else None
+
+    @classmethod
+    def exact(cls, text):
+        """ Matches messages that are exactly the given text. """
+        return cls(cls.EXACT, text)
+
+    @classmethod
+    def prefix(cls, text):
+        """ Matches messages that start with the given text. """
+        return cls(cls.PREFIX, text)
+
+    @classmethod
+    def mention(cls):
+        """ Matches messages that @mention at least one member. """
+        return cls(cls.MENTION)
+
+    @classmethod
+    def any(cls):
+        """ Matches every message. """
+        return cls(cls.ANY)
+
+    def __repr__(self):
+        return 'Trigger({0.kind!r}, {0.text!r})'.format(self)
+
+class AutoResponseDispatcher(object):
+    """ An index of auto responses by their :class:`Trigger`\s, used to find
+        the few auto responses that could match a message without calling
+        every callback.
+
+        Exact triggers are looked up in a dict, prefix triggers with one dict
+        lookup per distinct prefix length, and 'any' triggers are always
+        included. Candidates are returned in the order the auto responses
+        were given in.
+    """
+
+    def __init__(self, auto_responses):
+        self.auto_responses = list(auto_responses)
+        self._exact = {}
+        self._prefix = {}
+        self._prefix_lengths = ()
+        self._mention = []
+        self._any = []
+
+        for index, auto_rsp in enumerate(self.auto_responses):
+            for trigger in auto_rsp.triggers:
+                entry = (index, auto_rsp)
+                if trigger.kind == Trigger.EXACT:
+                    self._exact.setdefault(trigger.text, []).append(entry)
+                elif trigger.kind == Trigger.PREFIX:
+                    self._prefix.setdefault(trigger.text, []).append(entry)
+                elif trigger.kind == Trigger.MENTION:
+                    self._mention.append(entry)
+                else:
+                    self._any.append(entry)
+        self._prefix_lengths = tuple(sorted({len(text) for text in self._prefix}))
+
+    def candidates(self, message):
+        """ Returns a list of the auto responses that could match message. """
+        content = message.content.lower()
+
+        found = list(self._any)
+        found.extend(self._exact.get(content, ()))
+        for length in self._prefix_lengths:
+            if length > len(content):
+                break
+            found.extend(self._prefix.get(content[:length], ()))
+        if message.mentions:
+            found.extend(self._mention)
+
+        if len(found) > 1:
+            found = sorted(set(found), key=lambda entry: entry[0])
+        return [auto_rsp for index, auto_rsp in found]
+
+ServerTable = collections.namedtuple('ServerTable', 'dispatcher channels')
+
+AutoResponseSettings = collections.namedtuple('AutoResponseSettings', 'enabled cooldown servers')
+AutoResponseSettings.__doc__ = """ The saved settings of one :class:`AutoResponse`, see its
+    ``enabled``, ``cooldown`` and ``servers`` attributes.
+"""
+
+def _enabled_in(settings, no_pm, server_id, channel_id=None):
+    server = settings.servers.get(server_id, None)
+    if server is None:
+        return settings.enabled and not (server_id is None and no_pm)
+    if channel_id is not None:
+        enabled = server.get('channels', {}).get(channel_id, None)
+        if enabled is not None:
+            return enabled
+    return server.get('enabled', settings.enabled)
+
+class AutoResponseTables(object):
+    """ The auto responses enabled in each server and channel, compiled
+        into :class:`AutoResponseDispatcher`\s so that finding the ones to
+        run for a message takes a dict lookup by server id instead of
+        checking settings.
+
+        Tables are never changed once made, and only read the auto
+        responses' triggers and ``no_pm``, so they can be made on another
+        thread. When settings change, a new one is made from the new
+        :class:`AutoResponseSettings` and swapped in whole.
+
+        Attributes
+        -----------
+        auto_responses : tuple
+            Every auto response, enabled or not, in order.
+        default : ServerTable
+            Used for servers without server or channel settings.
+        private : ServerTable
+            Used for private messages. Leaves out ``no_pm`` auto responses.
+        servers : dict
+            A :class:`ServerTable` by server id, for servers with settings.
+    """
+
+    def __init__(self, auto_responses, settings=None):
+        """ settings is a list of :class:`AutoResponseSettings` in the same
+            order as auto_responses, by default their current settings.
+        """
+        self.auto_responses = tuple(auto_responses)
+        if settings is None:
+            settings = [a.settings for a in self.auto_responses]
+        pairs = list(zip(self.auto_responses, settings))
+        self._dispatchers = {} # tuple of enabled auto responses -> dispatcher, shared between tables
+
+        enabled = [a for a, a_settings in pairs if a_settings.enabled]
+        self.default = ServerTable(self._dispatcher(enabled), {})
+        self.private = ServerTable(self._dispatcher(a for a in enabled if not a.no_pm), {})
+
+        self.servers = {}
+        server_ids = set(server_id for a, a_settings in pairs for server_id in a_settings.servers)
+        for server_id in server_ids:
+            channel_ids = set(channel_id for a, a_settings in pairs
+                              for channel_id in a_settings.servers.get(server_id, {}).get('channels', {}))
+            channels = {channel_id : self._dispatcher(a for a, a_settings in pairs
+                                                      if _enabled_in(a_settings, a.no_pm, server_id, channel_id))
+                        for channel_id in channel_ids}
+            dispatcher = self._dispatcher(a for a, a_settings in pairs
+                                          if _enabled_in(a_settings, a.no_pm, server_id))
+            self.servers[server_id] = ServerTable(dispatcher, channels)
+
+    def _dispatcher(self, auto_responses):
+        auto_responses = tuple(auto_responses)
+        dispatcher = self._dispatchers.get(auto_responses, None)
+        if dispatcher is None:
+            dispatcher = AutoResponseDispatcher(auto_responses)
+            self._dispatchers[auto_responses] = dispatcher
+        return dispatcher
+
+    def candidates(self, message):
+        """ Returns a list of the auto responses that are enabled where
+            message was sent and could match it.
+        """
+        server = message.server
+        if server is None:
+            table = self.private
+        else:
+            table = self.servers.get(server.id, self.default)
+        if table.channels:
+            return table.channels.get(message.channel.id, table.dispatcher).candidates(message)
+        return table.dispatcher.candidates(message)
+
 class AutoResponse(object):
     """ This class represents a coroutine that will be called when 
         a message is received by the bot. This coroutine should only
@@ -192,20 +630,39 @@ class AutoResponse(object):
             The coroutine that is executed when the auto-response is enabled.
             This coroutine must take in the args: (bot, message) and must
             return if either of those args do not meet the function's conditions.
+        instance
+            The cog the auto-response belongs to, passed to callback as
+            ``self``. Set when the cog is added to the bot.
         description : str
             The description for this auto-response.
+        resolved : bool
+            ``True`` once enabled has been read from the AutoResponse.saveFile
+            data file.
         default_enabled: bool
             A boolean that indicates if the auto-response is enabled by
             default. Defaults to True.
         no_pm : bool
             If ``True``\, then the auto-response will not be triggered in
             private messages. Defaults to ``False``.
+        triggers : tuple
+            The :class:`Trigger`\s saying which messages could make this
+            auto-response do something. Messages that match none of them
+            skip the callback entirely. Defaults to ``(Trigger.any(),)``.
+        cooldown : :class:`extensions.cooldowns.Cooldown`
+            How often the auto-response may run, or None for no limit. Can be
+            changed with the 'cooldown' entry in the AutoResponse.saveFile data
+            file. Defaults to None.
         enabled : bool
-            A boolean that indicates if the auto-response is currently enabled.
-            When disabled, the auto-response can never be triggered.
+            A boolean that indicates if the auto-response is enabled, in
+            servers and channels without their own setting.
+        servers : dict
+            Settings for single servers, read from the 'servers' entry in the
+            AutoResponse.saveFile data file. Maps server ids to a dict with
+            an optional 'enabled' bool, and an optional 'channels' dict of
+            channel ids to bools. See :meth:`enabled_in`.
         json : str
             A str in json format containing the AutoResponse name, description,
-            and whether or not it is enabled.
+            cooldown, and whether or not it is enabled.
 
         Raises
         -------
@@ -221,30 +678,19 @@ class AutoResponse(object):
             raise AttributeError('AutoResponse must have a description')
 
         self.callback = callback
+        self.instance = None
         self.description = description
         self.no_pm = attrs.get('no_pm', False)
+        self.default_enabled = attrs.get('default_enabled', True)
+        self.triggers = tuple(attrs.get('triggers', None) or (Trigger.any(),))
+        self.cooldown = attrs.get('cooldown', None)
+        self.default_cooldown = self.cooldown # used when the saved one is invalid
+        self.servers = {}
 
-        self.data_man = DataManager()
-
-        self.try_to_enable(attrs.get('default_enabled', True))
-
-    def try_to_enable(self, default_enabled : bool):
-        """ Enables or disables this AutoResponse, and updates the setting in
-            the AutoResponse.saveFile data file.
-        """
-        auto_rsp_json = self.data_man.load_json(AutoResponse.saveFile)
-        if not auto_rsp_json or auto_rsp_json == '':
-            self._enabled = default_enabled
-            auto_rsp_json = {self.name : self.json_dict}
-        else:
-            this_json = auto_rsp_json.get(self.name, None)
-            if this_json:
-                self._enabled = this_json.get('enabled', default_enabled)
-                auto_rsp_json[self.name] = self.json_dict
-            else:
-                self._enabled = default_enabled
-                auto_rsp_json[self.name] = self.json_dict
-        self.data_man.save_json(auto_rsp_json, AutoResponse.saveFile)
+        # the saved setting is only read once the bot registers this auto
+        # response, see :meth:`AutoResponseRegistry.resolve`
+        self._enabled = self.default_enabled
+        self.resolved = False
 
     @property
     def name(self):
@@ -254,17 +700,125 @@ class AutoResponse(object):
     def enabled(self):
         return self._enabled
 
+    def enabled_in(self, server_id, channel_id=None):
+        """ Returns whether the auto-response is enabled in the given server
+            (None for private messages) and channel. A channel setting wins
+            over a server setting, which wins over :attr:`enabled`.
+        """
+        return _enabled_in(self.settings, self.no_pm, server_id, channel_id)
+
+    @property
+    def settings(self):
+        """ The current :class:`AutoResponseSettings`. """
+        return AutoResponseSettings(self._enabled, self.cooldown, self.servers)
+
+    def settings_from_json(self, this_json):
+        """ Returns the :class:`AutoResponseSettings` saved in this_json
+            (this auto response's entry in the AutoResponse.saveFile data
+            file, or None), without changing this auto response.
+        """
+        if not this_json:
+            return AutoResponseSettings(self.default_enabled, self.default_cooldown, {})
+        cooldown = self.default_cooldown
+        if 'cooldown' in this_json:
+            cooldown = Cooldown.from_json(this_json['cooldown'], default=self.default_cooldown)
+        # copy, since loaded objects are shared with the DataManager cache
+        return AutoResponseSettings(this_json.get('enabled', self.default_enabled), cooldown,
+                                    copy.deepcopy(this_json.get('servers', None) or {}))
+
+    def apply_settings(self, settings):
+        """ Uses the given :class:`AutoResponseSettings` from now on. """
+        self._enabled, self.cooldown, self.servers = settings
+        self.resolved = True
+
     @property
     def json(self):
         return json.dumps(self.simple_dict)
 
     @property
     def json_dict(self):
+        return self.settings_json_dict(self.settings)
+
+    def settings_json_dict(self, settings):
+        """ Returns :attr:`json_dict` as it would be with the given
+            :class:`AutoResponseSettings`.
+        """
         simple_dict = {'name' : self.name,
-                       'enabled' : self.enabled,
-                       'description' : self.description}
+                       'enabled' : settings.enabled,
+                       'description' : self.description,
+                       'cooldown' : settings.cooldown.json_dict if settings.cooldown else None,
+                       'servers' : settings.servers}
         return simple_dict
 
+class AutoResponseRegistry(object):
+    """ Collects every :class:`AutoResponse` as it is declared, and resolves
+        whether they are enabled in batches, so registering any number of
+        auto responses takes one read and at most one write of the
+        AutoResponse.saveFile data file.
+
+        Attributes
+        -----------
+        declared : list
+            Every auto response made with :func:`auto_response`, in order.
+    """
+
+    def __init__(self):
+        self.declared = []
+
+    def declare(self, auto_response):
+        self.declared.append(auto_response)
+
+    def forget(self, auto_response):
+        """ Removes an auto response, like when its cog is unloaded. """
+        if auto_response in self.declared:
+            self.declared.remove(auto_response)
+
+    @property
+    def unresolved(self):
+        return [a for a in self.declared if not a.resolved]
+
+    def resolve(self, data_man, auto_responses=None):
+        """ Sets whether each auto response is enabled from its saved
+            setting, and saves settings for any that are new or changed.
+            Resolves every unresolved declared auto response if none are
+            given.
+        """
+        if auto_responses is None:
+            auto_responses = self.unresolved
+        for auto_rsp, settings in zip(auto_responses, self.read_settings(data_man, auto_responses)):
+            auto_rsp.apply_settings(settings)
+
+    def read_settings(self, data_man, auto_responses):
+        """ Returns the saved :class:`AutoResponseSettings` of each auto
+            response, in order, and saves settings for any that are new or
+            changed. Does not change the auto responses, so it can run on
+            another thread while they are in use.
+        """
+        if not auto_responses:
+            return []
+
+        auto_rsp_json = data_man.load_json(AutoResponse.saveFile)
+        # copy, since loaded objects are shared with the DataManager cache
+        auto_rsp_json = dict(auto_rsp_json) if auto_rsp_json else {}
+
+        changed = False
+        all_settings = []
+        for auto_rsp in auto_responses:
+            this_json = auto_rsp_json.get(auto_rsp.name, None)
+            settings = auto_rsp.settings_from_json(this_json)
+            all_settings.append(settings)
+
+            json_dict = auto_rsp.settings_json_dict(settings)
+            if this_json != json_dict:
+                auto_rsp_json[auto_rsp.name] = json_dict
+                changed = True
+
+        if changed:
+            data_man.save_json(auto_rsp_json, AutoResponse.saveFile)
+        return all_settings
+
+registry = AutoResponseRegistry()
+
 
 def auto_response(**attrs):
     """ A decorator that transforms a fucntion into a :class:`AutoResponse`.
@@ -274,6 +828,11 @@ def auto_response(**attrs):
         ``inspect.cleandoc``. If the docstring is ``bytes``, then it is decoded
         into ``str`` using utf-8 encoding.
 
+        Pass ``triggers=[...]`` with :class:`Trigger`\s so that the callback is
+        only called for messages that could match. Without triggers, it is
+        called for every message. Pass ``cooldown=Cooldown(...)`` to limit how
+        often it runs.
+
         Raises
         -------
         TypeError
@@ -284,8 +843,6 @@ def auto_response(**attrs):
         if not asyncio.iscoroutinefunction(func):
             raise TypeError('Callback must be a coroutine.')
 
-        # Eventually cooldown stuff may go here
-
         # get description
         description = attrs.get('description', None)
         if description is not None:
@@ -297,6 +854,8 @@ def auto_response(**attrs):
                 description = description.decode('utf-8')
             description = description.replace('\n', ' ') # remove all newline chars
 
-        return AutoResponse(func, description, **attrs)
+        auto_rsp = AutoResponse(func, description, **attrs)
+        registry.declare(auto_rsp)
+        return auto_rsp
 
     return decorator
\ No newline at end of file
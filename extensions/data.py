@@ -1,6 +1,18 @@
+import asyncio
+import atexit
+import collections
+import concurrent.futures
+import functools
 import json
+import logging
 import os
 import pickle
+import tempfile
+import threading
+
+from .logstore import LogStore
+from .metrics import metrics
+from .sqlite_store import SQLiteBackend
 
 data_dir = 'data' # this dir is placed in the parent dir of '/extensions'
 json_dir = 'json' # this is a sub-dir of data_dir
@@ -19,46 +31,579 @@ if not os.path.exists(json_dir):
 if not os.path.exists(pickle_dir):
     os.makedirs(pickle_dir)
 
+sqlite_filename = 'data.sqlite3' # placed in data_dir when json is stored in sqlite
+storage_env_var = 'EMBERBOT_STORAGE' # 'files' (default) or 'sqlite'
+
+default_cache_size = 64 # max number of parsed json files kept in memory
+io_worker_count = 4 # max number of threads doing disk io for the *_async methods
+temp_file_suffix = '.tmp' # files are written under a temp name and renamed into place
+
+# mkstemp always makes 0600 files, so new files get the mode open() would give them
+_umask = os.umask(0)
+os.umask(_umask)
+new_file_mode = 0o666 & ~_umask
+
+logger = logging.getLogger('discord')
+
+# shared by every DataManager, so disk io from coroutines is bounded bot-wide
+io_executor = concurrent.futures.ThreadPoolExecutor(max_workers=io_worker_count)
+
+def _file_signature(path):
+    """ Returns a cheap signature of the file at path that changes whenever
+        the file is rewritten, or None if the file does not exist.
+    """
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+class SettingsCache(object):
+    """ A size-bounded, least-recently-used cache of parsed data files.
+
+        Entries are keyed by filename and remember the signature of the file
+        they were parsed from, so a changed file on disk is picked up again
+        on the next lookup.
+
+        Attributes
+        -----------
+        max_entries : int
+            The max number of files kept in memory before the least recently
+            used one is evicted.
+        hits : int
+            The number of lookups answered from memory.
+        misses : int
+            The number of lookups that had to read the file.
+        evictions : int
+            The number of entries dropped to stay under max_entries.
+    """
+
+    def __init__(self, max_entries=default_cache_size):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = collections.OrderedDict() # path -> (signature, obj)
+        self._lock = threading.Lock() # the *_async methods use the cache from io_executor
+
+    def get(self, path, loader):
+        """ Returns the cached object for path, calling loader(path) to
+            (re-)read it when it is not cached or changed on disk.
+        """
+        signature = _file_signature(path)
+        with self._lock:
+            entry = self._entries.get(path, None)
+            if entry is not None and signature is not None and entry[0] == signature:
+                self.hits += 1
+                self._entries.move_to_end(path)
+                return entry[1]
+            self.misses += 1
+
+        obj = loader(path)
+        if obj is None or signature is None:
+            self.invalidate(path)
+        else:
+            self.put(path, obj, signature=signature)
+        return obj
+
+    def put(self, path, obj, signature=None):
+        """ Stores obj as the current contents of the file at path. """
+        with self._lock:
+            if signature is None:
+                signature = _file_signature(path)
+            self._entries[path] = (signature, obj)
+            self._entries.move_to_end(path)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, path=None):
+        """ Drops the entry for path, or every entry if path is None. """
+        with self._lock:
+            if path is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(path, None)
+
+    @property
+    def stats(self):
+        return {'hits' : self.hits,
+                'misses' : self.misses,
+                'evictions' : self.evictions,
+                'size' : len(self._entries),
+                'max_entries' : self.max_entries}
+
+def atomic_write(path, data):
+    """ Writes data (bytes) to path without ever leaving a partially written
+        file behind, by writing to a temp file and renaming it over path.
+        The file keeps its mode, or gets :data:`new_file_mode` if it is new.
+    """
+    dirname, basename = os.path.split(path)
+    try:
+        mode = os.stat(path).st_mode & 0o7777
+    except FileNotFoundError:
+        mode = new_file_mode
+    fd, temp_path = tempfile.mkstemp(prefix='.' + basename, suffix=temp_file_suffix, dir=dirname)
+    try:
+        if hasattr(os, 'fchmod'): # not on windows
+            os.fchmod(fd, mode)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+
+    # make sure the rename itself survives a crash (not supported on windows)
+    if hasattr(os, 'O_DIRECTORY'):
+        dir_fd = os.open(dirname, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+class FileWriter(object):
+    """ Writes files atomically, optionally in write-behind mode.
+
+        In write-behind mode, saves are kept in memory and every save to the
+        same file within one window of ``delay`` seconds is coalesced into
+        a single write, done from a timer thread. :meth:`flush` writes
+        everything that is still pending right away.
+
+        Attributes
+        -----------
+        delay : float
+            Seconds to wait after the first pending save before flushing.
+            If 0, every save is written immediately.
+        writes : int
+            The number of files actually written to disk.
+        coalesced : int
+            The number of saves that were replaced by a later save before
+            they were written.
+    """
+
+    def __init__(self, delay=0):
+        self.delay = delay
+        self.writes = 0
+        self.coalesced = 0
+        self._pending = {} # path -> bytes
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock() # keeps flushes of the same file in order
+        self._timer = None
+
+    def write(self, path, data):
+        """ Saves data (bytes) to path, now or at the next flush. """
+        if self.delay <= 0:
+            with self._flush_lock:
+                with self._lock: # an older pending save is now stale
+                    self._pending.pop(path, None)
+                atomic_write(path, data)
+                self.writes += 1
+            return
+
+        with self._lock:
+            if path in self._pending:
+                self.coalesced += 1
+            self._pending[path] = data
+            if self._timer is None:
+                self._timer = threading.Timer(self.delay, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def pending_data(self, path):
+        """ Returns the bytes waiting to be written to path, or None. """
+        with self._lock:
+            return self._pending.get(path, None)
+
+    def flush(self):
+        """ Writes every pending save to disk. Saves that fail are logged
+            and kept pending, to be tried again on the next flush.
+        """
+        with self._flush_lock:
+            with self._lock:
+                pending = self._pending
+                self._pending = {}
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+
+            failed = {}
+            for path, data in pending.items():
+                try:
+                    atomic_write(path, data)
+                except Exception as e:
+                    logger.error('Failed to write {0}: {1}'.format(path, e))
+                    failed[path] = data
+                    continue
+                self.writes += 1
+
+            if failed:
+                with self._lock:
+                    for path, data in failed.items():
+                        self._pending.setdefault(path, data) # unless saved again meanwhile
+                    if self.delay > 0 and self._timer is None:
+                        self._timer = threading.Timer(self.delay, self.flush)
+                        self._timer.daemon = True
+                        self._timer.start()
+
+    @property
+    def stats(self):
+        with self._lock:
+            pending = len(self._pending)
+        return {'writes' : self.writes,
+                'coalesced' : self.coalesced,
+                'pending' : pending,
+                'delay' : self.delay}
+
+# shared by every DataManager, so all parts of the bot see the same objects
+json_cache = SettingsCache()
+file_writer = FileWriter()
+
+# do not lose pending writes when a script simply exits
+atexit.register(file_writer.flush)
+
+class JsonFileBackend(object):
+    """ Stores every json document as its own file under json_dir,
+        through :data:`json_cache` and :data:`file_writer`.
+
+        Changing a single key with :meth:`put_key` rewrites the whole file,
+        so documents with many entries that change often are better kept
+        in a :class:`SQLiteBackend`.
+    """
+
+    name = 'files'
+
+    def __init__(self, directory=None, cache=None, writer=None):
+        self._directory = directory
+        self.cache = cache if cache is not None else json_cache
+        self.writer = writer if writer is not None else file_writer
+
+    @property
+    def directory(self):
+        # json_dir is looked up on use, so it can be pointed elsewhere (like by benchmarks)
+        return self._directory if self._directory is not None else json_dir
+
+    def load(self, name):
+        path = os.path.join(self.directory, name)
+        return self.cache.get(path, self._read)
+
+    def _read(self, path):
+        try:
+            pending = self.writer.pending_data(path)
+            if pending is not None:
+                return json.loads(pending.decode('utf-8'))
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (FileNotFoundError, EOFError, ValueError): # will be json.decoder.JSONDecodeError
+        #                                                   instead of ValueError in python 3.6 (instead of 3.4)
+            return None
+
+    def save(self, obj, name):
+        path = os.path.join(self.directory, name)
+        text = json.dumps(obj, indent=2)
+        self.writer.write(path, text.encode('utf-8'))
+        # cache what a fresh load would return, not the caller's object
+        self.cache.put(path, json.loads(text))
+
+    def get_key(self, name, key, default=None):
+        obj = self.load(name)
+        return obj.get(key, default) if isinstance(obj, dict) else default
+
+    def put_key(self, name, key, value):
+        obj = self.load(name)
+        if obj is None:
+            obj = {}
+        elif not isinstance(obj, dict):
+            raise TypeError('{} is not a json object'.format(name))
+        obj = dict(obj) # the loaded object is shared with the cache
+        obj[key] = value
+        self.save(obj, name)
+
+    def delete_key(self, name, key):
+        obj = self.load(name)
+        if isinstance(obj, dict) and key in obj:
+            obj = dict(obj)
+            del obj[key]
+            self.save(obj, name)
+
+    def walk(self, root):
+        for dirpath, dirnames, filenames in os.walk(self.directory):
+            # leave out temp files from writes in progress
+            filenames = [name for name in filenames if not name.startswith('.')]
+            yield (dirpath, dirnames, filenames)
+
+    def flush(self):
+        self.writer.flush()
+
+    def close(self):
+        self.flush()
+
+    @property
+    def stats(self):
+        return self.cache.stats
+
+def make_backend(name):
+    """ Returns a new json backend by name, 'files' or 'sqlite'. """
+    if name == JsonFileBackend.name:
+        return JsonFileBackend()
+    if name == SQLiteBackend.name:
+        return SQLiteBackend(os.path.join(data_dir, sqlite_filename))
+    raise ValueError('unknown storage backend {!r}'.format(name))
+
+# where every DataManager stores json documents, unless given its own backend
+json_backend = make_backend(os.environ.get(storage_env_var, JsonFileBackend.name))
+
+def use_backend(backend):
+    """ Switches every DataManager without a backend of its own to backend
+        (a backend object, or a name for :func:`make_backend`).
+    """
+    global json_backend
+    if isinstance(backend, str):
+        backend = make_backend(backend)
+    json_backend.close()
+    json_backend = backend
+    return backend
+
+# keyed stores of pickled values, by path, shared like json_cache and file_writer
+log_stores = {}
+_log_stores_lock = threading.Lock()
+
+def open_log_store(filename):
+    """ Returns the shared :class:`LogStore` for data/pickled/filename,
+        opening it the first time.
+    """
+    path = os.path.join(pickle_dir, filename)
+    with _log_stores_lock:
+        store = log_stores.get(path, None)
+        if store is None:
+            store = LogStore(path)
+            log_stores[path] = store
+        return store
+
+def close_log_stores():
+    with _log_stores_lock:
+        stores = list(log_stores.values())
+        log_stores.clear()
+    for store in stores:
+        store.close()
+
+atexit.register(close_log_stores)
+
 class DataManager(object):
+    """ Loads and saves the bot's data files.
+
+        Json documents are stored by a backend: one file per document
+        (:class:`JsonFileBackend`, the default) or a SQLite database
+        (:class:`SQLiteBackend`), picked with the EMBERBOT_STORAGE
+        environment variable or :func:`use_backend`. Objects returned by
+        :meth:`load_json` are shared with the backend's cache, so they
+        should be treated as read-only unless they are saved back with
+        :meth:`save_json`. Single entries of a document can be read and
+        changed with :meth:`get_json_key` and :meth:`put_json_key`, which
+        the SQLite backend does without touching the rest of it.
+
+        Files are always replaced atomically through :data:`file_writer`.
+        Use :meth:`set_write_delay` to turn on write-behind mode, and
+        :meth:`flush` before the process stops or restarts.
+
+        Pickled data that is looked up by key can be kept in a keyed store
+        (a :class:`LogStore`) with :meth:`get_pickled_key` and
+        :meth:`put_pickled_key`, which only write and unpickle the one value
+        instead of the whole object like :meth:`save_pickled` and
+        :meth:`load_pickled` do.
+
+        Every method that touches the disk has a coroutine version with an
+        ``_async`` suffix that runs it on :data:`io_executor`, so it does
+        not block the event loop. The plain methods are still fine to use
+        from scripts or outside of the event loop.
+    """
     
-    def __init__(self):
-        pass
+    def __init__(self, backend=None):
+        self.cache = json_cache
+        self.writer = file_writer
+        self._backend = backend
+
+    @property
+    def backend(self):
+        """ The json backend in use, :data:`json_backend` unless this
+            DataManager was given its own.
+        """
+        return self._backend if self._backend is not None else json_backend
 
+    def set_write_delay(self, seconds):
+        """ Turns on write-behind mode for every DataManager, coalescing
+            saves made within the given number of seconds. Passing 0 goes
+            back to writing on every save.
+        """
+        if seconds <= 0:
+            self.writer.flush()
+        self.writer.delay = seconds
+
+    @metrics.timed('data')
+    def flush(self):
+        """ Writes any saves still pending in write-behind mode. """
+        self.writer.flush()
+        if self.backend.name != JsonFileBackend.name:
+            self.backend.flush()
+        with _log_stores_lock:
+            stores = list(log_stores.values())
+        for store in stores:
+            store.flush()
+
+    @metrics.timed('data')
     def save_pickled(self, obj, filename):
         """ Pickles the given object and saves in data/filename. """
         path = os.path.join(pickle_dir, filename)
-        with open(path, 'wb+') as f:
-            pickle.dump(obj, f, pickle.HIGHEST_PROTOCOL)
+        self.writer.write(path, pickle.dumps(obj, pickle.HIGHEST_PROTOCOL))
 
 
+    @metrics.timed('data')
     def load_pickled(self, filename):
         """ Loads the pickled object from data/filename. """
         try:
             path = os.path.join(pickle_dir, filename)
+            pending = self.writer.pending_data(path)
+            if pending is not None:
+                return pickle.loads(pending)
             with open(path, 'rb') as f:
                 return pickle.load(f)
         except (FileNotFoundError, EOFError):
             return None
             
 
+    def log_store(self, filename):
+        """ Returns the keyed store in data/pickled/filename, for using it
+            directly (like to iterate over it).
+        """
+        return open_log_store(filename)
+
+    @metrics.timed('data')
+    def get_pickled_key(self, filename, key, default=None):
+        """ Returns the value stored for key in the keyed store in
+            data/pickled/filename, or default.
+        """
+        return open_log_store(filename).get(key, default)
+
+    @metrics.timed('data')
+    def put_pickled_key(self, filename, key, value):
+        """ Stores value for key in the keyed store in data/pickled/filename. """
+        open_log_store(filename).put(key, value)
+
+    @metrics.timed('data')
+    def delete_pickled_key(self, filename, key):
+        """ Removes key from the keyed store in data/pickled/filename. """
+        open_log_store(filename).delete(key)
+
+    @metrics.timed('data')
     def save_json(self, obj, filename):
         """ Saves the given object in data/filename, in json format. """
-        path = os.path.join(json_dir, filename)
-        with open(path, 'w+') as f:
-            json.dump(obj, f, indent=2)
+        self.backend.save(obj, filename)
 
 
+    @metrics.timed('data')
     def load_json(self, filename):
         """ Loads the json-encoded object from data/filename. """
-        try:
-            path = os.path.join(json_dir, filename)
-            with open(path, 'r') as f:
-                return json.load(f)
-        except (FileNotFoundError, EOFError, ValueError): # will be json.decoder.JSONDecodeError
-        #                                                   instead of ValueError in python 3.6 (instead of 3.4)
-            return None
+        return self.backend.load(filename)
+
+    @metrics.timed('data')
+    def get_json_key(self, filename, key, default=None):
+        """ Returns obj[key] of the json object in data/filename, or
+            default if either is missing.
+        """
+        return self.backend.get_key(filename, key, default)
+
+    @metrics.timed('data')
+    def put_json_key(self, filename, key, value):
+        """ Sets obj[key] = value in the json object in data/filename,
+            creating it if needed.
+        """
+        self.backend.put_key(filename, key, value)
+
+    @metrics.timed('data')
+    def delete_json_key(self, filename, key):
+        """ Removes key from the json object in data/filename. """
+        self.backend.delete_key(filename, key)
 
     def walk_json(self):
-        """ Equivalent to os.walk(json_dir). """
-        for dirpath, dirnames, filenames in os.walk(json_dir):
-            yield (dirpath, dirnames, filenames)
\ No newline at end of file
+        """ Equivalent to os.walk(json_dir), over the stored json documents. """
+        return self.backend.walk(json_dir)
+
+    def _run_in_executor(self, func, *args):
+        loop = asyncio.get_event_loop()
+        return loop.run_in_executor(io_executor, functools.partial(func, *args))
+
+    @asyncio.coroutine
+    def flush_async(self):
+        """ Coroutine version of :meth:`flush`. """
+        yield from self._run_in_executor(self.flush)
+
+    @asyncio.coroutine
+    def save_pickled_async(self, obj, filename):
+        """ Coroutine version of :meth:`save_pickled`. """
+        yield from self._run_in_executor(self.save_pickled, obj, filename)
+
+    @asyncio.coroutine
+    def load_pickled_async(self, filename):
+        """ Coroutine version of :meth:`load_pickled`. """
+        obj = yield from self._run_in_executor(self.load_pickled, filename)
+        return obj
+
+    @asyncio.coroutine
+    def get_pickled_key_async(self, filename, key, default=None):
+        """ Coroutine version of :meth:`get_pickled_key`. """
+        value = yield from self._run_in_executor(self.get_pickled_key, filename, key, default)
+        return value
+
+    @asyncio.coroutine
+    def put_pickled_key_async(self, filename, key, value):
+        """ Coroutine version of :meth:`put_pickled_key`. """
+        yield from self._run_in_executor(self.put_pickled_key, filename, key, value)
+
+    @asyncio.coroutine
+    def delete_pickled_key_async(self, filename, key):
+        """ Coroutine version of :meth:`delete_pickled_key`. """
+        yield from self._run_in_executor(self.delete_pickled_key, filename, key)
+
+    @asyncio.coroutine
+    def save_json_async(self, obj, filename):
+        """ Coroutine version of :meth:`save_json`. """
+        yield from self._run_in_executor(self.save_json, obj, filename)
+
+    @asyncio.coroutine
+    def load_json_async(self, filename):
+        """ Coroutine version of :meth:`load_json`. """
+        obj = yield from self._run_in_executor(self.load_json, filename)
+        return obj
+
+    @asyncio.coroutine
+    def get_json_key_async(self, filename, key, default=None):
+        """ Coroutine version of :meth:`get_json_key`. """
+        value = yield from self._run_in_executor(self.get_json_key, filename, key, default)
+        return value
+
+    @asyncio.coroutine
+    def put_json_key_async(self, filename, key, value):
+        """ Coroutine version of :meth:`put_json_key`. """
+        yield from self._run_in_executor(self.put_json_key, filename, key, value)
+
+    @asyncio.coroutine
+    def delete_json_key_async(self, filename, key):
+        """ Coroutine version of :meth:`delete_json_key`. """
+        yield from self._run_in_executor(self.delete_json_key, filename, key)
+
+    @asyncio.coroutine
+    def walk_json_async(self):
+        """ Coroutine version of :meth:`walk_json`. Returns a list instead
+            of a generator, since the walk is done on another thread.
+        """
+        walked = yield from self._run_in_executor(self._walk_json_list)
+        return walked
+
+    @metrics.timed('data', 'walk_json')
+    def _walk_json_list(self):
+        return list(self.walk_json())
@@ -1,23 +1,51 @@
 import asyncio
+import collections
 import datetime
 import logging
 import random
-import requests
 import time
 
 import discord
 from discord.ext import commands
 
-from .core import AutoResponse, auto_response
+from .cooldowns import BucketType, Cooldown, cooldown
+from .core import AutoResponse, Trigger, auto_response
 
 class Fun():
     """ Filled with fun commands for the bot. """
 
+    chuck_norris_url = 'http://api.icndb.com/jokes/random/{count}'
+    joke_buffer_size = 10 # number of chuck norris jokes to keep ready
+    joke_refill_at = 3 # fetch more jokes when only this many are left
+
     def __init__(self, bot):
         self.bot = bot
         self.data_man = bot.data_man
         self.logger = logging.getLogger('discord')
 
+        self.jokes = collections.deque()
+        self._joke_refill = None
+        self._start_joke_refill()
+
+    def _start_joke_refill(self):
+        """ Starts fetching more jokes in the background, unless that is
+            already happening. Returns the task doing it.
+        """
+        if self._joke_refill is None or self._joke_refill.done():
+            self._joke_refill = self.bot.loop.create_task(self._refill_jokes())
+        return self._joke_refill
+
+    @asyncio.coroutine
+    def _refill_jokes(self):
+        count = self.joke_buffer_size - len(self.jokes)
+        if count <= 0:
+            return
+        try:
+            chuck_pull = yield from self.bot.web_client.get_json(self.chuck_norris_url.format(count=count))
+            self.jokes.extend(j['joke'] for j in chuck_pull['value'])
+        except Exception as e:
+            self.logger.warning('Could not fetch chuck norris jokes: {}'.format(repr(e)))
+
     @commands.command(name='8ball')
     @asyncio.coroutine
     def eight_ball(self, *, message : str):
@@ -84,17 +112,25 @@ class Fun():
         yield from self.bot.say(response)
 
     @commands.command(aliases=['chuck'])
+    @cooldown(1, 5, BucketType.channel)
     @asyncio.coroutine
     def chucknorris(self):
         """ Want to know some interesting Chuck Norris facts? """
         joke_msg = '[**Chuck**] {joke}'
 
-        chuckPull = requests.get('http://api.icndb.com/jokes/random')
-        if chuckPull and chuckPull.status_code  == 200:
-            joke = chuckPull.json()['value']['joke']
+        if not self.jokes:
+            # shielded, so the refill is not lost if this command is cancelled
+            yield from asyncio.shield(self._start_joke_refill(), loop=self.bot.loop)
+
+        if self.jokes:
+            joke = self.jokes.popleft()
             yield from self.bot.say(joke_msg.format(joke=joke))
 
-    @auto_response()
+        if len(self.jokes) <= self.joke_refill_at:
+            self._start_joke_refill()
+
+    @auto_response(triggers=[Trigger.exact('ping')],
+                   cooldown=Cooldown(3, 10, BucketType.channel))
     @asyncio.coroutine
     def auto_pong(self, bot, message):
         """ Says 'pong' when someone says 'ping' in the chat. """
@@ -0,0 +1,73 @@
+import json
+import os
+
+from .core import AutoResponseDispatcher, Trigger
+
+manifest_filename = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'manifest.json')
+
+class _ManifestEntry(object):
+    """ Stands in for the auto-responses of an extension that is not loaded
+        yet, so the extension can be found with an
+        :class:`extensions.core.AutoResponseDispatcher`.
+    """
+
+    def __init__(self, name, triggers):
+        self.name = name
+        self.triggers = tuple(triggers)
+
+class LazyExtensions(object):
+    """ Knows the commands (and aliases) and auto-response triggers of every
+        extension from extensions/manifest.json, so that an extension only
+        has to be imported the first time a message could use it.
+
+        Extensions marked ``"eager": true`` are loaded on connect instead.
+
+        Attributes
+        -----------
+        eager : list
+            The names of extensions to load on connect.
+        pending : set
+            The names of lazy extensions that have not been loaded yet.
+    """
+
+    def __init__(self, manifest):
+        self.eager = []
+        self.pending = set()
+        self.commands = {} # command name or alias -> extension name
+        entries = []
+
+        for name, info in sorted(manifest.items()):
+            if info.get('eager', False):
+                self.eager.append(name)
+                continue
+            self.pending.add(name)
+            for command in info.get('commands', []):
+                self.commands[command] = name
+            triggers = [Trigger(t['kind'], t.get('text', None)) for t in info.get('triggers', [])]
+            if triggers:
+                entries.append(_ManifestEntry(name, triggers))
+        self._dispatcher = AutoResponseDispatcher(entries)
+
+    @classmethod
+    def from_file(cls, path=manifest_filename):
+        with open(path, 'r', encoding='utf-8') as f:
+            return cls(json.load(f))
+
+    def needed_for(self, message, invoked_with=None):
+        """ Returns a list of the pending extensions that message could use,
+            given the command name it invokes (or None if it is not a
+            command). Invoking 'help' needs every extension, so that all
+            commands show up in it.
+        """
+        if not self.pending:
+            return []
+        if invoked_with == 'help':
+            return sorted(self.pending)
+
+        needed = set(entry.name for entry in self._dispatcher.candidates(message))
+        if invoked_with is not None and invoked_with in self.commands:
+            needed.add(self.commands[invoked_with])
+        return sorted(needed & self.pending)
+
+    def loaded(self, name):
+        self.pending.discard(name)
@@ -0,0 +1,99 @@
+def _is_member_id(value):
+    return isinstance(value, str) and value.isdigit()
+
+class LinkedAccounts(object):
+    """ An index of which member accounts belong to the same person, built
+        with union-find over the lists in 'linked_accounts.json'.
+
+        Links do not need to be listed both ways in the file. If any list
+        links two accounts, they end up in the same group. Keys and values
+        that are not member ids (like 'description') are ignored.
+    """
+
+    def __init__(self):
+        self._parent = {} # member id -> parent member id
+        self._groups = None # member id -> frozenset of its group, built on demand
+
+    @classmethod
+    def from_json(cls, accounts_info):
+        linked = cls()
+        for member_id, account_ids in accounts_info.items():
+            if not _is_member_id(member_id) or not isinstance(account_ids, list):
+                continue
+            linked._add(member_id)
+            for account_id in account_ids:
+                if _is_member_id(account_id):
+                    linked.link(member_id, account_id)
+        return linked
+
+    def _add(self, member_id):
+        if member_id not in self._parent:
+            self._parent[member_id] = member_id
+
+    def _find(self, member_id):
+        parent = self._parent
+        while parent[member_id] != member_id:
+            parent[member_id] = parent[parent[member_id]] # path halving
+            member_id = parent[member_id]
+        return member_id
+
+    def link(self, member_id, other_id):
+        """ Puts both accounts in the same group. """
+        self._add(member_id)
+        self._add(other_id)
+        root, other_root = self._find(member_id), self._find(other_id)
+        if root != other_root:
+            self._parent[other_root] = root
+            self._groups = None
+
+    def group(self, member_id):
+        """ Returns a frozenset of every account linked to member_id
+            (including itself), or None if it is not linked to any.
+        """
+        return self._build_groups().get(member_id, None)
+
+    def _build_groups(self):
+        if self._groups is None:
+            by_root = {}
+            for member in self._parent:
+                by_root.setdefault(self._find(member), set()).add(member)
+            self._groups = {}
+            for members in by_root.values():
+                if len(members) > 1:
+                    members = frozenset(members)
+                    for member in members:
+                        self._groups[member] = members
+        return self._groups
+
+    def others(self, member_ids):
+        """ Returns a sorted list of the accounts linked to any of member_ids,
+            leaving out member_ids themselves.
+        """
+        found = set()
+        for member_id in member_ids:
+            group = self.group(member_id)
+            if group:
+                found.update(group)
+        found.difference_update(member_ids)
+        return sorted(found)
+
+    def to_json(self, accounts_info):
+        """ Returns a copy of accounts_info with the lists of every linked
+            account replaced by the groups in this index. Other entries (like
+            'description') are kept.
+        """
+        updated = {k : v for k, v in accounts_info.items() if not _is_member_id(k)}
+        for member_id, group in self._build_groups().items():
+            updated[member_id] = sorted(group)
+        return updated
+
+    def without(self, member_id):
+        """ Returns a new index with member_id unlinked from every account. """
+        linked = LinkedAccounts()
+        for member, group in self._build_groups().items():
+            if member == member_id:
+                continue
+            for other in group:
+                if other != member_id:
+                    linked.link(member, other)
+        return linked
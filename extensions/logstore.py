@@ -0,0 +1,271 @@
+import logging
+import mmap
+import os
+import pickle
+import struct
+import threading
+import zlib
+
+# every record is a header, the key (utf-8) and the pickled value
+_header = struct.Struct('<III') # crc32 of the rest, key length, value length
+_lengths = struct.Struct('<II') # the part of the header covered by the crc
+_tombstone = 0xFFFFFFFF # value length of a record that deletes its key
+
+compact_min_bytes = 1024 * 1024 # files smaller than this are never compacted in the background
+compact_dead_ratio = 0.5 # compact once this much of the file is overwritten or deleted records
+compact_suffix = '.compact' # the compacted copy is written under this suffix and renamed into place
+
+def _encode(key, value_bytes):
+    """ Returns the record for key, deleting it if value_bytes is None. """
+    key_bytes = key.encode('utf-8')
+    value_len = _tombstone if value_bytes is None else len(value_bytes)
+    body = _lengths.pack(len(key_bytes), value_len) + key_bytes + (value_bytes or b'')
+    return struct.pack('<I', zlib.crc32(body) & 0xFFFFFFFF) + body
+
+def _scan(buf, start, end):
+    """ Yields (offset, key, value_offset, value_len, record_end) for every
+        whole, intact record in buf[start:end]. A value_len of None marks a
+        deleted key. Stops at the first torn or corrupt record.
+    """
+    offset = start
+    while offset + _header.size <= end:
+        crc, key_len, value_len = _header.unpack_from(buf, offset)
+        deleted = value_len == _tombstone
+        stored_len = 0 if deleted else value_len
+        key_offset = offset + _header.size
+        record_end = key_offset + key_len + stored_len
+        if record_end > end or zlib.crc32(buf[offset + 4:record_end]) & 0xFFFFFFFF != crc:
+            return
+        key = bytes(buf[key_offset:key_offset + key_len]).decode('utf-8')
+        yield (offset, key, key_offset + key_len, None if deleted else value_len, record_end)
+        offset = record_end
+
+class LogStore(object):
+    """ An append-only, log-structured key/value store in a single file.
+
+        Every :meth:`put` or :meth:`delete` appends one record, so changing
+        a key never rewrites the rest of the data. An in-memory index maps
+        each key to where its latest value is in the file, and values are
+        read through a memory map, so :meth:`get` only unpickles the one
+        value asked for.
+
+        Overwritten and deleted records stay in the file until it is
+        compacted, which happens on a background thread once they make up
+        :data:`compact_dead_ratio` of it. A torn record at the end of the
+        file (like from a crash mid-write) is cut off when it is opened.
+
+        Keys are strings, values anything that can be pickled.
+
+        Attributes
+        -----------
+        path : str
+            The path of the log file.
+        sync : bool
+            If True, every write is fsync-ed before returning. Otherwise
+            writes reach the OS right away (so they survive the process
+            crashing), and are fsync-ed on :meth:`flush`.
+        compactions : int
+            The number of times the file was compacted.
+    """
+
+    def __init__(self, path, sync=False):
+        self.path = path
+        self.sync = sync
+        self.compactions = 0
+        self.logger = logging.getLogger('discord')
+        self._lock = threading.RLock()
+        self._index = {} # key -> (value offset, value length)
+        self._size = 0 # bytes of whole records in the file
+        self._dead_bytes = 0 # bytes of records that were overwritten or deleted
+        self._file = None
+        self._map = None
+        self._compactor = None
+        self._open()
+
+    def _open(self):
+        self._file = open(self.path, 'a+b', buffering=0)
+        size = os.fstat(self._file.fileno()).st_size
+        self._index = {}
+        self._size = 0
+        self._dead_bytes = 0
+        self._remap(size)
+        if self._map is not None:
+            self._apply(self._map, 0, size)
+        if self._size < size:
+            self.logger.warning('cutting off {0} bytes of torn or corrupt records at the end of {1}'.format(
+                size - self._size, self.path))
+            self._remap(0) # windows can not truncate a mapped file
+            self._file.truncate(self._size)
+            self._remap(self._size)
+
+    def _remap(self, size):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        if size > 0: # an empty file can not be mapped
+            self._map = mmap.mmap(self._file.fileno(), size, access=mmap.ACCESS_READ)
+
+    def _apply(self, buf, start, end):
+        """ Adds the records in buf[start:end] to the index. """
+        for offset, key, value_offset, value_len, record_end in _scan(buf, start, end):
+            old = self._index.pop(key, None)
+            if old is not None:
+                self._dead_bytes += self._record_size(key, old[1])
+            if value_len is None:
+                self._dead_bytes += record_end - offset # the tombstone itself
+            else:
+                self._index[key] = (value_offset, value_len)
+            self._size = record_end
+
+    @staticmethod
+    def _record_size(key, value_len):
+        return _header.size + len(key.encode('utf-8')) + value_len
+
+    def _append(self, record):
+        self._file.write(record)
+        if self.sync:
+            os.fsync(self._file.fileno())
+        offset = self._size
+        self._size += len(record)
+        return offset
+
+    def get(self, key, default=None):
+        """ Returns the value stored for key, or default. """
+        with self._lock:
+            location = self._index.get(key, None)
+            if location is None:
+                return default
+            value_offset, value_len = location
+            if self._map is None or len(self._map) < value_offset + value_len:
+                self._remap(self._size)
+            value_bytes = self._map[value_offset:value_offset + value_len]
+        return pickle.loads(value_bytes)
+
+    def put(self, key, value):
+        """ Stores value for key. """
+        value_bytes = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        record = _encode(key, value_bytes)
+        with self._lock:
+            offset = self._append(record)
+            old = self._index.get(key, None)
+            if old is not None:
+                self._dead_bytes += self._record_size(key, old[1])
+            self._index[key] = (offset + len(record) - len(value_bytes), len(value_bytes))
+        self._maybe_compact()
+
+    def delete(self, key):
+        """ Removes key, if it is stored. """
+        with self._lock:
+            old = self._index.pop(key, None)
+            if old is None:
+                return
+            record = _encode(key, None)
+            self._append(record)
+            self._dead_bytes += self._record_size(key, old[1]) + len(record)
+        self._maybe_compact()
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._index
+
+    def __len__(self):
+        with self._lock:
+            return len(self._index)
+
+    def keys(self):
+        """ Returns a list of every stored key. """
+        with self._lock:
+            return list(self._index)
+
+    def items(self):
+        """ Yields (key, value) for every stored key. """
+        for key in self.keys():
+            value = self.get(key, self)
+            if value is not self: # deleted since keys() was called
+                yield (key, value)
+
+    def flush(self):
+        """ Makes sure every write so far is on disk. """
+        with self._lock:
+            if self._file is not None:
+                os.fsync(self._file.fileno())
+
+    def _maybe_compact(self):
+        with self._lock:
+            if (self._size < compact_min_bytes or self._dead_bytes < self._size * compact_dead_ratio or
+                    (self._compactor is not None and self._compactor.is_alive())):
+                return
+            self._compactor = threading.Thread(target=self.compact, name='logstore-compact', daemon=True)
+            self._compactor.start()
+
+    def compact(self):
+        """ Rewrites the file with only the latest record of every key.
+
+            Most of the copying is done without holding the lock, since
+            records already in the file never change. Records appended
+            meanwhile are copied over at the end, while holding the lock.
+        """
+        temp_path = self.path + compact_suffix
+        with self._lock:
+            if self._file is None:
+                return
+            snapshot = dict(self._index)
+            snapshot_size = self._size
+            dead_before = self._dead_bytes
+
+        new_index = {}
+        with open(self.path, 'rb') as source, open(temp_path, 'wb') as target:
+            for key, (value_offset, value_len) in snapshot.items():
+                source.seek(value_offset)
+                value_bytes = source.read(value_len)
+                record = _encode(key, value_bytes)
+                new_index[key] = (target.tell() + len(record) - value_len, value_len)
+                target.write(record)
+            target.flush()
+
+            with self._lock:
+                if self._file is None:
+                    os.remove(temp_path)
+                    return
+                # copy whatever was written since the snapshot as is
+                source.seek(snapshot_size)
+                tail = source.read(self._size - snapshot_size)
+                tail_start = target.tell()
+                target.write(tail)
+                target.flush()
+                os.fsync(target.fileno())
+
+                self._remap(0)
+                self._file.close()
+                os.replace(temp_path, self.path)
+
+                self._file = open(self.path, 'a+b', buffering=0)
+                self._index = new_index
+                self._size = tail_start
+                self._dead_bytes = 0
+                self._remap(tail_start + len(tail))
+                if tail:
+                    self._apply(self._map, tail_start, tail_start + len(tail))
+                self.compactions += 1
+        self.logger.debug('compacted {0}, dropping {1} bytes'.format(self.path, dead_before))
+
+    def close(self):
+        with self._lock:
+            if self._file is None:
+                return
+            self.flush()
+            if self._map is not None:
+                self._map.close()
+                self._map = None
+            self._file.close()
+            self._file = None
+        if self._compactor is not None:
+            self._compactor.join()
+
+    @property
+    def stats(self):
+        with self._lock:
+            return {'keys' : len(self._index),
+                    'bytes' : self._size,
+                    'dead_bytes' : self._dead_bytes,
+                    'compactions' : self.compactions}
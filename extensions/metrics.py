@@ -0,0 +1,168 @@
+import bisect
+import contextlib
+import functools
+import threading
+import time
+
+# upper bounds (in seconds) of the latency histogram buckets
+latency_buckets = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class Series(object):
+    """ The counters and latency histogram for one thing being measured. """
+
+    __slots__ = ('calls', 'errors', 'total_sec', 'max_sec', 'buckets')
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.total_sec = 0.0
+        self.max_sec = 0.0
+        self.buckets = [0] * (len(latency_buckets) + 1) # the last one is +Inf
+
+    def observe(self, seconds, error):
+        self.calls += 1
+        if error:
+            self.errors += 1
+        self.total_sec += seconds
+        if seconds > self.max_sec:
+            self.max_sec = seconds
+        self.buckets[bisect.bisect_left(latency_buckets, seconds)] += 1
+
+    def merge(self, other):
+        """ Adds the counts from another Series into this one. """
+        self.calls += other.calls
+        self.errors += other.errors
+        self.total_sec += other.total_sec
+        self.max_sec = max(self.max_sec, other.max_sec)
+        self.buckets = [a + b for a, b in zip(self.buckets, other.buckets)]
+
+    def percentile(self, fraction):
+        """ Returns the upper bound of the bucket holding the given fraction
+            of calls, which is an estimate of that percentile.
+        """
+        if not self.calls:
+            return 0.0
+        wanted = fraction * self.calls
+        seen = 0
+        for i, count in enumerate(self.buckets):
+            seen += count
+            if seen >= wanted:
+                return min(latency_buckets[i], self.max_sec) if i < len(latency_buckets) else self.max_sec
+        return self.max_sec
+
+class Metrics(object):
+    """ Call counts, error counts and latency histograms, by kind (like
+        'command' or 'auto_response') and name. Safe to use from any thread.
+    """
+
+    def __init__(self):
+        self._series = {} # (kind, name) -> Series
+        self._lock = threading.Lock()
+
+    def observe(self, kind, name, seconds, error=False):
+        with self._lock:
+            series = self._series.get((kind, name), None)
+            if series is None:
+                series = self._series[(kind, name)] = Series()
+            series.observe(seconds, error)
+
+    @contextlib.contextmanager
+    def timer(self, kind, name):
+        """ A context manager that observes how long its block takes, and
+            counts an error if the block raises.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        except BaseException:
+            self.observe(kind, name, time.perf_counter() - start, error=True)
+            raise
+        self.observe(kind, name, time.perf_counter() - start)
+
+    def timed(self, kind, name=None):
+        """ A decorator that times every call of a function with :meth:`timer`.
+            Defaults to using the function's name as the name.
+        """
+        def decorator(func):
+            series_name = name or func.__name__
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.timer(kind, series_name):
+                    return func(*args, **kwargs)
+
+            return wrapper
+        return decorator
+
+    def snapshot(self):
+        """ Returns a sorted list of (kind, name, copy of Series). """
+        with self._lock:
+            items = []
+            for (kind, name), series in self._series.items():
+                copied = Series()
+                copied.calls = series.calls
+                copied.errors = series.errors
+                copied.total_sec = series.total_sec
+                copied.max_sec = series.max_sec
+                copied.buckets = list(series.buckets)
+                items.append((kind, name, copied))
+        items.sort(key=lambda item: (item[0], item[1]))
+        return items
+
+    def merge(self, snapshot):
+        """ Adds the series from a :meth:`snapshot` (like one taken in
+            another process) into this one.
+        """
+        with self._lock:
+            for kind, name, other in snapshot:
+                series = self._series.get((kind, name), None)
+                if series is None:
+                    series = self._series[(kind, name)] = Series()
+                series.merge(other)
+
+    def summary_lines(self, kind=None):
+        """ Returns one line of text per series, busiest first. """
+        items = [item for item in self.snapshot() if kind is None or item[0] == kind]
+        items.sort(key=lambda item: item[2].calls, reverse=True)
+        lines = []
+        for kind, name, series in items:
+            mean_ms = series.total_sec / series.calls * 1000 if series.calls else 0.0
+            lines.append('{kind:<13} {name:<24} calls={calls:<7} errors={errors:<4} '
+                         'mean={mean:.1f}ms p99<={p99:.1f}ms max={max:.1f}ms'.format(
+                             kind=kind, name=name, calls=series.calls, errors=series.errors,
+                             mean=mean_ms, p99=series.percentile(0.99) * 1000,
+                             max=series.max_sec * 1000))
+        return lines
+
+    def prometheus_text(self):
+        """ Returns every series in the Prometheus text exposition format. """
+        items = self.snapshot()
+
+        def labels(kind, name, extra=''):
+            return '{{kind="{0}",name="{1}"{2}}}'.format(kind, str(name).replace('"', '\\"'), extra)
+
+        lines = ['# HELP emberbot_calls_total Number of calls.',
+                 '# TYPE emberbot_calls_total counter']
+        lines.extend('emberbot_calls_total{0} {1}'.format(labels(k, n), s.calls) for k, n, s in items)
+        lines.extend(['# HELP emberbot_errors_total Number of calls that raised an error.',
+                      '# TYPE emberbot_errors_total counter'])
+        lines.extend('emberbot_errors_total{0} {1}'.format(labels(k, n), s.errors) for k, n, s in items)
+        lines.extend(['# HELP emberbot_latency_seconds Time taken by each call.',
+                      '# TYPE emberbot_latency_seconds histogram'])
+        for kind, name, series in items:
+            cumulative = 0
+            for bound, count in zip(latency_buckets + (float('inf'),), series.buckets):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append('emberbot_latency_seconds_bucket{0} {1}'.format(
+                    labels(kind, name, ',le="{}"'.format(le)), cumulative))
+            lines.append('emberbot_latency_seconds_sum{0} {1!r}'.format(labels(kind, name), series.total_sec))
+            lines.append('emberbot_latency_seconds_count{0} {1}'.format(labels(kind, name), series.calls))
+        return '\n'.join(lines) + '\n'
+
+    def reset(self):
+        with self._lock:
+            self._series.clear()
+
+# shared by the whole bot, including code that has no reference to it
+metrics = Metrics()
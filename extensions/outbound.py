@@ -0,0 +1,142 @@
+import asyncio
+import collections
+import logging
+import time
+
+max_message_length = 2000 # discord's limit on message content
+
+class _ChannelState(object):
+    """ The pending messages and rate limit bucket for one channel. """
+
+    __slots__ = ('pending', 'task', 'tokens', 'updated')
+
+    def __init__(self, tokens, updated):
+        self.pending = collections.deque() # of (content, kwargs, future)
+        self.task = None
+        self.tokens = tokens
+        self.updated = updated
+
+class OutboundQueue(object):
+    """ A queue for every message the bot sends.
+
+        Each channel gets its own queue, drained by its own task, so sends to
+        different channels happen in parallel while messages to one channel
+        keep their order. Consecutive text-only messages to the same channel
+        are merged into one message, as long as it stays under discord's
+        2000 character limit, and each channel is held to ``rate`` messages
+        every ``per`` seconds so the bot does not run into discord's rate
+        limits.
+
+        Attributes
+        -----------
+        sent : int
+            The number of messages actually sent.
+        merged : int
+            The number of queued messages that were merged into another one
+            instead of being sent by themselves.
+    """
+
+    rate = 5 # messages...
+    per = 5.0 # ...every this many seconds, per channel
+
+    def __init__(self, bot, clock=time.monotonic):
+        self.bot = bot
+        self.sent = 0
+        self.merged = 0
+        self.logger = logging.getLogger('discord')
+        self._clock = clock
+        self._channels = {} # channel id -> _ChannelState
+
+    def send(self, destination, content=None, **kwargs):
+        """ Queues a message, with the same arguments as
+            ``bot.send_message``. Returns a future with the sent
+            :class:`discord.Message`\, which may be shared with other
+            messages it was merged with.
+        """
+        state = self._channels.get(destination.id, None)
+        if state is None:
+            state = _ChannelState(self.rate, self._clock())
+            self._channels[destination.id] = state
+
+        future = asyncio.Future(loop=self.bot.loop)
+        # failures are logged in _drain, so callers do not have to wait on future
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        state.pending.append((content, kwargs, future))
+        if state.task is None:
+            state.task = self.bot.loop.create_task(self._drain(destination, state))
+        return future
+
+    @asyncio.coroutine
+    def _drain(self, destination, state):
+        try:
+            while state.pending:
+                yield from self._wait_for_token(state)
+                content, kwargs, futures = self._take_batch(state.pending)
+                try:
+                    message = yield from self.bot.send_message(destination, content, **kwargs)
+                except Exception as e:
+                    self.logger.error('Failed to send queued message to {0}: {1}'.format(destination.id, e))
+                    for future in futures:
+                        if not future.done():
+                            future.set_exception(e)
+                    continue
+                self.sent += 1
+                for future in futures:
+                    if not future.done():
+                        future.set_result(message)
+        finally:
+            state.task = None
+            if not state.pending:
+                # once the bucket is full again, a new state would be the same
+                refill_sec = (self.rate - state.tokens) * self.per / self.rate
+                self.bot.loop.call_later(max(0, refill_sec), self._forget, destination.id, state)
+
+    def _forget(self, channel_id, state):
+        """ Drops an idle channel's state, so channels the bot no longer
+            sends to do not use up memory.
+        """
+        if state.task is None and not state.pending and self._channels.get(channel_id, None) is state:
+            del self._channels[channel_id]
+
+    @asyncio.coroutine
+    def _wait_for_token(self, state):
+        """ Waits until the channel's bucket has a message to spend. """
+        now = self._clock()
+        state.tokens = min(self.rate, state.tokens + (now - state.updated) * self.rate / self.per)
+        state.updated = now
+        if state.tokens < 1:
+            yield from asyncio.sleep((1 - state.tokens) * self.per / self.rate, loop=self.bot.loop)
+            state.tokens = 1
+            state.updated = self._clock()
+        state.tokens -= 1
+
+    def _take_batch(self, pending):
+        """ Pops the next message to send off of pending, merged with as many
+            of the text-only messages right after it as will fit.
+        """
+        content, kwargs, future = pending.popleft()
+        futures = [future]
+        if kwargs or not isinstance(content, str):
+            return content, kwargs, futures
+
+        parts = [content]
+        length = len(content)
+        while pending:
+            next_content, next_kwargs, next_future = pending[0]
+            if next_kwargs or not isinstance(next_content, str):
+                break
+            if length + 1 + len(next_content) > max_message_length:
+                break
+            pending.popleft()
+            parts.append(next_content)
+            futures.append(next_future)
+            length += 1 + len(next_content)
+            self.merged += 1
+        return '\n'.join(parts), kwargs, futures
+
+    @property
+    def stats(self):
+        return {'sent' : self.sent,
+                'merged' : self.merged,
+                'pending' : sum(len(s.pending) for s in self._channels.values()),
+                'channels' : len(self._channels)}
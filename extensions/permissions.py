@@ -0,0 +1,102 @@
+import asyncio
+
+admin_filename = 'admin_roles.json'
+default_admin_config = {'description' : 'Who the bot counts as an \'admin\'. Having any one of'
+                                        ' the role names, or all of the permissions, is enough.'
+                                        ' Add an entry with a server id as the key to change'
+                                        ' this for one server.',
+                        'default' : {'role_names' : ['Admin', 'Moderator', 'bot_admin'],
+                                     'permissions' : {'administrator' : True}}}
+
+class PermissionCache(object):
+    """ Remembers whether members count as admins, so admin-only commands
+        do not have to look through roles and permissions on every use.
+
+        An entry is only used while the member's server is at the same role
+        version (bumped whenever a role on the server changes) and the admin
+        settings are the same object (the DataManager cache gives back a new
+        one when the file changes). Member updates drop that member's entry.
+
+        The admin settings are kept in memory, so checks never touch the
+        data file. They are read by :meth:`load_admin_config`, and until
+        then :data:`default_admin_config` is used.
+
+        Attributes
+        -----------
+        admin_config : dict
+            The admin settings loaded from :data:`admin_filename`, or None
+            if they are not loaded yet.
+        hits : int
+            The number of checks answered from the cache.
+        misses : int
+            The number of checks that had to look at roles.
+    """
+
+    def __init__(self):
+        self.admin_config = None
+        self.hits = 0
+        self.misses = 0
+        self._role_versions = {} # server id -> int
+        self._entries = {} # (server id, member id) -> (role version, config, is admin)
+
+    @asyncio.coroutine
+    def load_admin_config(self, data_man):
+        """ Reads the admin settings from :data:`admin_filename`, saving
+            the defaults if there are none. Call again after the file is
+            edited.
+        """
+        admin_config = yield from data_man.load_json_async(admin_filename)
+        if not admin_config:
+            yield from data_man.save_json_async(default_admin_config, admin_filename)
+            admin_config = yield from data_man.load_json_async(admin_filename)
+        self.admin_config = admin_config
+
+    def is_admin(self, member, admin_config=None):
+        """ Returns whether member counts as an admin on its server, using
+            admin_config, or by default the loaded admin settings.
+        """
+        if admin_config is None:
+            admin_config = self.admin_config or default_admin_config
+        server_id = member.server.id
+        key = (server_id, member.id)
+        version = self._role_versions.get(server_id, 0)
+        entry = self._entries.get(key, None)
+        if entry is not None and entry[0] == version and entry[1] is admin_config:
+            self.hits += 1
+            return entry[2]
+
+        self.misses += 1
+        result = self._resolve(member, admin_config)
+        self._entries[key] = (version, admin_config, result)
+        return result
+
+    @staticmethod
+    def _resolve(member, admin_config):
+        server_config = admin_config.get(member.server.id, None) or admin_config.get('default', None) \
+                        or default_admin_config['default']
+        role_names = set(server_config.get('role_names', ()))
+        admin_perms = server_config.get('permissions', {})
+
+        if any(role.name in role_names for role in member.roles):
+            return True
+        if not admin_perms:
+            return False
+        permissions = member.server_permissions
+        return all(getattr(permissions, perm, None) == value for perm, value in admin_perms.items())
+
+    def member_changed(self, member):
+        self._entries.pop((member.server.id, member.id), None)
+
+    def roles_changed(self, server):
+        self._role_versions[server.id] = self._role_versions.get(server.id, 0) + 1
+
+    def server_removed(self, server):
+        self._role_versions.pop(server.id, None)
+        for key in [k for k in self._entries if k[0] == server.id]:
+            del self._entries[key]
+
+    @property
+    def stats(self):
+        return {'hits' : self.hits,
+                'misses' : self.misses,
+                'size' : len(self._entries)}
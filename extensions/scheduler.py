@@ -0,0 +1,289 @@
+import asyncio
+import datetime
+import heapq
+import itertools
+import logging
+import random
+import sys
+import time
+import traceback
+
+from .metrics import metrics
+
+class Interval(object):
+    """ Runs a job every given number of seconds. """
+
+    def __init__(self, seconds):
+        if seconds <= 0:
+            raise ValueError('interval must be positive')
+        self.seconds = seconds
+
+    def next_after(self, when):
+        """ Returns the unix time of the next run after the run at when. """
+        return when + self.seconds
+
+    def __str__(self):
+        return 'every {:g}s'.format(self.seconds)
+
+class Cron(object):
+    """ Runs a job at the minutes matching a cron-like spec of five fields:
+        minute, hour, day of month, month and day of week (0 is monday), in
+        local time. Each field is '*', a number, a range like '1-5', a step
+        like '*/15' or '0-30/10', or a comma separated list of those.
+
+        Unlike cron, a job runs only when both the day of month and the day
+        of week match.
+    """
+
+    _ranges = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 6))
+
+    def __init__(self, spec):
+        fields = spec.split()
+        if len(fields) != 5:
+            raise ValueError('cron spec needs 5 fields: {!r}'.format(spec))
+        self.spec = spec
+        self.minutes, self.hours, self.days, self.months, self.weekdays = (
+            self._parse(field, low, high) for field, (low, high) in zip(fields, self._ranges))
+
+    @staticmethod
+    def _parse(field, low, high):
+        values = set()
+        for part in field.split(','):
+            step = 1
+            if '/' in part:
+                part, step = part.split('/')
+                step = int(step)
+            if part == '*':
+                start, end = low, high
+            elif '-' in part:
+                start, end = (int(x) for x in part.split('-'))
+            else:
+                start = int(part)
+                end = start if step == 1 else high
+            if not low <= start <= end <= high or step < 1:
+                raise ValueError('cron field {!r} out of range {}-{}'.format(field, low, high))
+            values.update(range(start, end + 1, step))
+        return frozenset(values)
+
+    def next_after(self, when):
+        t = datetime.datetime.fromtimestamp(when).replace(second=0, microsecond=0) + datetime.timedelta(minutes=1)
+        limit = t + datetime.timedelta(days=366 * 5) # a spec like feb 30 never matches
+        while t < limit:
+            if t.month not in self.months:
+                t = (t.replace(day=1, hour=0, minute=0) + datetime.timedelta(days=32)).replace(day=1)
+            elif t.day not in self.days or t.weekday() not in self.weekdays:
+                t = t.replace(hour=0, minute=0) + datetime.timedelta(days=1)
+            elif t.hour not in self.hours:
+                t = t.replace(minute=0) + datetime.timedelta(hours=1)
+            elif t.minute not in self.minutes:
+                t += datetime.timedelta(minutes=1)
+            else:
+                return time.mktime(t.timetuple())
+        raise ValueError('cron spec {!r} never matches'.format(self.spec))
+
+    def __str__(self):
+        return 'cron {}'.format(self.spec)
+
+class Job(object):
+    """ A coroutine function run on a schedule by a :class:`Scheduler`.
+
+        Attributes
+        -----------
+        name : str
+            The unique name of the job, also used for its metrics.
+        callback : coroutine function
+            Called with no arguments on every run.
+        schedule
+            An :class:`Interval`, a :class:`Cron`, or anything else with a
+            ``next_after(unix_time)`` method. Can be changed while the job
+            is scheduled, and is used from the next run on.
+        jitter : float
+            Up to this many seconds are randomly added to every run, so jobs
+            on many bots (or shards) do not all run at once.
+        owner
+            What added the job (like a cog), for cancelling all of its jobs
+            at once.
+        runs : int
+            The number of times the job has started.
+        skipped : int
+            The number of runs skipped because the last run had not finished.
+        next_run : float
+            The unix time of the next run.
+    """
+
+    def __init__(self, name, callback, schedule, jitter=0, owner=None):
+        self.name = name
+        self.callback = callback
+        self.schedule = schedule
+        self.jitter = jitter
+        self.owner = owner
+        self.runs = 0
+        self.skipped = 0
+        self.last_run = None
+        self.next_run = None
+        self.due = None # next_run without the jitter
+        self.cancelled = False
+        self.task = None
+
+    @property
+    def running(self):
+        return self.task is not None and not self.task.done()
+
+    def _plan(self, after):
+        self.due = self.schedule.next_after(after)
+        self.next_run = self.due + (random.uniform(0, self.jitter) if self.jitter else 0)
+
+class JobSpec(object):
+    """ A job declared on a cog with :func:`scheduled`. The bot adds it to
+        its scheduler when the cog is added, and cancels it when the cog is
+        removed.
+    """
+
+    def __init__(self, callback, schedule, jitter=0, name=None):
+        self.callback = callback
+        self.schedule = schedule
+        self.jitter = jitter
+        self.name = name or callback.__name__
+
+def scheduled(every=None, cron=None, jitter=0, name=None):
+    """ A decorator that turns a cog's coroutine method into a job, run
+        every given number of seconds, or at the times of a :class:`Cron`
+        spec.
+
+        Raises
+        -------
+        TypeError
+            If the function is not a coroutine, or not exactly one of every
+            and cron is given.
+    """
+    if (every is None) == (cron is None):
+        raise TypeError('Pass exactly one of every and cron.')
+    schedule = Interval(every) if every is not None else Cron(cron)
+
+    def decorator(func):
+        if not asyncio.iscoroutinefunction(func):
+            raise TypeError('Callback must be a coroutine.')
+        return JobSpec(func, schedule, jitter=jitter, name=name)
+
+    return decorator
+
+class Scheduler(object):
+    """ Runs every periodic job of the bot from one task and one timer heap,
+        instead of each job having its own sleep loop.
+
+        Each job runs as its own task, so a slow job does not hold up the
+        others, but a job never runs twice at once: a run that comes up
+        while the last one is still going is skipped. Run times and errors
+        are recorded under the 'job' kind of :data:`extensions.metrics.metrics`.
+    """
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.jobs = {} # name -> Job
+        self.logger = logging.getLogger('discord')
+        self._heap = [] # (next run, tie breaker, job)
+        self._counter = itertools.count()
+        self._wakeup = asyncio.Event(loop=loop)
+        self._task = None
+
+    def add(self, name, callback, schedule, jitter=0, owner=None, run_now=False):
+        """ Schedules callback (a coroutine function taking no arguments),
+            replacing any job with the same name. Returns the :class:`Job`.
+        """
+        self.cancel(name)
+        job = Job(name, callback, schedule, jitter=jitter, owner=owner)
+        if run_now:
+            job.due = job.next_run = time.time()
+        else:
+            job._plan(time.time())
+        self.jobs[name] = job
+        self._push(job)
+        return job
+
+    def _push(self, job):
+        heapq.heappush(self._heap, (job.next_run, next(self._counter), job))
+        self._wakeup.set()
+
+    def cancel(self, name):
+        """ Stops a job from running again, cancelling it if it is running.
+            Returns ``False`` if there is no such job.
+        """
+        job = self.jobs.pop(name, None)
+        if job is None:
+            return False
+        job.cancelled = True # left in the heap, and dropped when it comes up
+        if job.running:
+            job.task.cancel()
+        return True
+
+    def cancel_owner(self, owner):
+        """ Cancels every job added with the given owner. """
+        for job in [j for j in self.jobs.values() if j.owner is owner]:
+            self.cancel(job.name)
+
+    def start(self):
+        """ Starts the scheduler's task, unless it is already running. """
+        if self._task is None or self._task.done():
+            self._task = self.loop.create_task(self.run())
+
+    def stop(self):
+        """ Stops the scheduler and cancels every running job. """
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        for job in self.jobs.values():
+            if job.running:
+                job.task.cancel()
+
+    @asyncio.coroutine
+    def run(self):
+        """ The task that starts jobs when they are due. """
+        while True:
+            self._wakeup.clear()
+            now = time.time()
+            while self._heap and self._heap[0][0] <= now:
+                when, _, job = heapq.heappop(self._heap)
+                if job.cancelled or job.next_run != when:
+                    continue # cancelled, or pushed again with another time
+                self._start_job(job, now)
+
+            timeout = self._heap[0][0] - now if self._heap else None
+            try:
+                yield from asyncio.wait_for(self._wakeup.wait(), timeout, loop=self.loop)
+            except asyncio.TimeoutError:
+                pass
+
+    def _start_job(self, job, now):
+        if job.running:
+            job.skipped += 1
+            self.logger.warning('skipping job {} since its last run has not finished'.format(job.name))
+        else:
+            job.runs += 1
+            job.last_run = now
+            job.task = self.loop.create_task(self._run_job(job))
+
+        # plan from when the run was due, so jobs do not drift, unless that
+        # is already in the past (like after the loop was blocked)
+        job._plan(job.due)
+        if job.due <= now:
+            job._plan(now)
+        self._push(job)
+
+    @asyncio.coroutine
+    def _run_job(self, job):
+        try:
+            with metrics.timer('job', job.name):
+                yield from job.callback()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            self.logger.error('Ignoring exception in job {}'.format(job.name))
+            print('Ignoring exception in job {}'.format(job.name), file=sys.stderr)
+            traceback.print_exc()
+
+    def reschedule(self, name, schedule):
+        """ Changes a job's schedule, planning its next run from now. """
+        job = self.jobs[name]
+        job.schedule = schedule
+        job._plan(time.time())
+        self._push(job)
@@ -0,0 +1,256 @@
+import collections
+import json
+import os
+import sqlite3
+import threading
+
+default_cache_size = 64 # max number of assembled documents kept in memory
+busy_timeout_ms = 5000 # how long to wait on another process' write (like another shard)
+
+schema = '''
+CREATE TABLE IF NOT EXISTS documents (
+    name TEXT PRIMARY KEY,
+    body TEXT -- NULL when the document is a json object kept in entries
+);
+CREATE TABLE IF NOT EXISTS entries (
+    name TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    PRIMARY KEY (name, key)
+);
+'''
+
+def _normalize(obj):
+    """ Returns what obj would be after a trip through json, so what is
+        cached matches what a fresh load returns.
+    """
+    return json.loads(json.dumps(obj))
+
+def walk_names(root, names):
+    """ Yields os.walk style (dirpath, dirnames, filenames) tuples for a
+        list of '/' separated names, as if they were files under root.
+    """
+    tree = ({}, []) # (sub-dirs by name, filenames)
+    for name in names:
+        parts = name.split('/')
+        node = tree
+        for part in parts[:-1]:
+            node = node[0].setdefault(part, ({}, []))
+        node[1].append(parts[-1])
+
+    stack = [(root, tree)]
+    while stack:
+        dirpath, (dirs, files) = stack.pop()
+        yield (dirpath, sorted(dirs), sorted(files))
+        for dirname in sorted(dirs, reverse=True):
+            stack.append((os.path.join(dirpath, dirname), dirs[dirname]))
+
+class SQLiteBackend(object):
+    """ Stores json documents in a single SQLite database in WAL mode.
+
+        Documents that are json objects are stored as one row per top-level
+        key, so :meth:`get_key` and :meth:`put_key` read and write a single
+        entry instead of the whole document. Anything else is stored as one
+        json blob.
+
+        Assembled documents are kept in a small LRU cache, which is dropped
+        whenever another connection (like another shard's process) commits.
+
+        Attributes
+        -----------
+        path : str
+            The path of the database file.
+        hits : int
+            The number of loads answered from memory.
+        misses : int
+            The number of loads that had to query the database.
+    """
+
+    name = 'sqlite'
+
+    def __init__(self, path, max_entries=default_cache_size):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._cache = collections.OrderedDict() # name -> assembled document
+        self._lock = threading.RLock() # the *_async methods use the backend from io_executor
+        self._conn = None
+        self._data_version = None
+
+    @property
+    def conn(self):
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL') # WAL stays consistent, a crash may lose the last commit
+            conn.execute('PRAGMA busy_timeout={}'.format(busy_timeout_ms))
+            conn.executescript(schema)
+            self._conn = conn
+        return self._conn
+
+    def _check_version(self):
+        """ Drops the cache if another connection changed the database. """
+        version = self.conn.execute('PRAGMA data_version').fetchone()[0]
+        if version != self._data_version:
+            self._cache.clear()
+            self._data_version = version
+
+    def _cache_put(self, name, obj):
+        self._cache[name] = obj
+        self._cache.move_to_end(name)
+        while len(self._cache) > self.max_entries:
+            self._cache.popitem(last=False)
+
+    def _document_body(self, name):
+        """ Returns (exists, body) for the document called name. """
+        row = self.conn.execute('SELECT body FROM documents WHERE name = ?', (name,)).fetchone()
+        if row is None:
+            return (False, None)
+        return (True, row[0])
+
+    def load(self, name):
+        """ Returns the document called name, or None if there is none. """
+        with self._lock:
+            self._check_version()
+            if name in self._cache:
+                self.hits += 1
+                self._cache.move_to_end(name)
+                return self._cache[name]
+            self.misses += 1
+
+            exists, body = self._document_body(name)
+            if not exists:
+                return None
+            if body is not None:
+                obj = json.loads(body)
+            else:
+                rows = self.conn.execute('SELECT key, value FROM entries WHERE name = ? ORDER BY rowid', (name,))
+                obj = {key : json.loads(value) for key, value in rows}
+            self._cache_put(name, obj)
+            return obj
+
+    def save(self, obj, name):
+        """ Replaces the whole document called name with obj. """
+        obj = _normalize(obj)
+        with self._lock:
+            conn = self.conn
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                conn.execute('DELETE FROM entries WHERE name = ?', (name,))
+                if isinstance(obj, dict):
+                    conn.execute('INSERT OR REPLACE INTO documents (name, body) VALUES (?, NULL)', (name,))
+                    conn.executemany('INSERT INTO entries (name, key, value) VALUES (?, ?, ?)',
+                                     [(name, key, json.dumps(value)) for key, value in obj.items()])
+                else:
+                    conn.execute('INSERT OR REPLACE INTO documents (name, body) VALUES (?, ?)',
+                                 (name, json.dumps(obj)))
+                conn.execute('COMMIT')
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+            self._check_version()
+            self._cache_put(name, obj)
+
+    def delete(self, name):
+        """ Removes the document called name, if there is one. """
+        with self._lock:
+            conn = self.conn
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                conn.execute('DELETE FROM entries WHERE name = ?', (name,))
+                conn.execute('DELETE FROM documents WHERE name = ?', (name,))
+                conn.execute('COMMIT')
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+            self._check_version()
+            self._cache.pop(name, None)
+
+    def get_key(self, name, key, default=None):
+        """ Returns one top-level entry of a document, without reading the
+            rest of it.
+        """
+        with self._lock:
+            self._check_version()
+            if name in self._cache:
+                obj = self._cache[name]
+                return obj.get(key, default) if isinstance(obj, dict) else default
+            row = self.conn.execute('SELECT value FROM entries WHERE name = ? AND key = ?',
+                                    (name, key)).fetchone()
+            return json.loads(row[0]) if row is not None else default
+
+    def put_key(self, name, key, value):
+        """ Sets one top-level entry of a document, creating the document
+            if needed. Raises TypeError if the document is not a json object.
+        """
+        value = _normalize(value)
+        text = json.dumps(value)
+        with self._lock:
+            conn = self.conn
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                exists, body = self._document_body(name)
+                if body is not None:
+                    raise TypeError('{} is not a json object'.format(name))
+                if not exists:
+                    conn.execute('INSERT INTO documents (name, body) VALUES (?, NULL)', (name,))
+                cursor = conn.execute('UPDATE entries SET value = ? WHERE name = ? AND key = ?', (text, name, key))
+                if cursor.rowcount == 0:
+                    conn.execute('INSERT INTO entries (name, key, value) VALUES (?, ?, ?)', (name, key, text))
+                conn.execute('COMMIT')
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+            self._update_cached(name, key, value)
+
+    def delete_key(self, name, key):
+        """ Removes one top-level entry of a document, if it is there. """
+        with self._lock:
+            self.conn.execute('DELETE FROM entries WHERE name = ? AND key = ?', (name, key))
+            self._update_cached(name, key, None, delete=True)
+
+    def _update_cached(self, name, key, value, delete=False):
+        # cached documents may be shared with callers, so change a copy
+        self._check_version()
+        obj = self._cache.get(name, None)
+        if obj is None:
+            return
+        obj = dict(obj)
+        if delete:
+            obj.pop(key, None)
+        else:
+            obj[key] = value
+        self._cache_put(name, obj)
+
+    def names(self):
+        """ Returns the sorted names of every document. """
+        with self._lock:
+            return [row[0] for row in self.conn.execute('SELECT name FROM documents ORDER BY name')]
+
+    def walk(self, root):
+        """ Like os.walk(root), over the document names. """
+        return walk_names(root, self.names())
+
+    def flush(self):
+        """ Moves committed changes from the write-ahead log into the
+            database file. Every change is already durable without it.
+        """
+        with self._lock:
+            if self._conn is not None:
+                self._conn.execute('PRAGMA wal_checkpoint(PASSIVE)')
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+            self._cache.clear()
+            self._data_version = None
+
+    @property
+    def stats(self):
+        return {'hits' : self.hits,
+                'misses' : self.misses,
+                'size' : len(self._cache),
+                'max_entries' : self.max_entries}
@@ -0,0 +1,121 @@
+import asyncio
+import collections
+import logging
+import sys
+import threading
+import time
+import traceback
+
+Stall = collections.namedtuple('Stall', 'when lag_sec task stack')
+Stall.__doc__ = """ A time the event loop was blocked for longer than the threshold.
+
+    ``when`` is a unix timestamp, ``task`` is the repr of the task that was
+    running (or None), and ``stack`` is the formatted stack of the event loop
+    thread while it was blocked (or None if it was not caught in time).
+"""
+
+def _current_task(loop):
+    current_task = getattr(asyncio, 'current_task', None) or asyncio.Task.current_task
+    try:
+        return current_task(loop=loop)
+    except RuntimeError:
+        return None
+
+class LoopWatchdog(object):
+    """ Measures how late the event loop runs scheduled callbacks (its lag),
+        and finds out what is blocking it.
+
+        A task on the loop wakes up every interval_sec and records how late
+        it was. Meanwhile a helper thread watches for that task to miss its
+        wake up by more than threshold_sec. When it does, the helper thread
+        captures the loop thread's stack while it is still blocked, so the
+        blocking call shows up in the log along with the task that made it.
+
+        Attributes
+        -----------
+        last_lag_sec : float
+            The lag measured on the most recent wake up.
+        max_lag_sec : float
+            The highest lag measured so far.
+        stalls : collections.deque
+            The most recent :class:`Stall`\\s, oldest first.
+    """
+
+    def __init__(self, loop, interval_sec=0.25, threshold_sec=0.5, max_stalls=20):
+        self.loop = loop
+        self.interval_sec = interval_sec
+        self.threshold_sec = threshold_sec
+        self.last_lag_sec = 0.0
+        self.max_lag_sec = 0.0
+        self.stall_count = 0
+        self.stalls = collections.deque(maxlen=max_stalls)
+        self.logger = logging.getLogger('discord')
+
+        self._beat = 0 # incremented every wake up
+        self._beat_time = time.monotonic()
+        self._captured = None # (beat, task, stack) from the helper thread
+        self._loop_thread_id = None
+        self._stopped = threading.Event()
+        self._thread = None
+
+    @asyncio.coroutine
+    def run(self):
+        """ The task that measures lag. Runs until :meth:`stop` is called. """
+        self._loop_thread_id = threading.get_ident()
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._monitor, name='loop-watchdog', daemon=True)
+        self._thread.start()
+
+        while not self._stopped.is_set():
+            self._beat += 1
+            self._beat_time = time.monotonic()
+            expected = self.loop.time() + self.interval_sec
+            yield from asyncio.sleep(self.interval_sec, loop=self.loop)
+
+            lag = max(0.0, self.loop.time() - expected)
+            self.last_lag_sec = lag
+            self.max_lag_sec = max(self.max_lag_sec, lag)
+            if lag >= self.threshold_sec:
+                self._record_stall(lag)
+
+    def stop(self):
+        self._stopped.set()
+
+    def _record_stall(self, lag):
+        task = stack = None
+        captured = self._captured
+        if captured is not None and captured[0] == self._beat:
+            task, stack = captured[1], captured[2]
+        self._captured = None
+
+        stall = Stall(time.time(), lag, task, stack)
+        self.stalls.append(stall)
+        self.stall_count += 1
+        self.logger.warning('Event loop was blocked for {0:.3f}s while running {1}\n{2}'.format(
+            lag, task or 'an unknown task', stack or '(stack was not captured)'))
+
+    def _monitor(self):
+        """ Runs on the helper thread, capturing the loop thread's stack
+            once per blocked wake up.
+        """
+        poll_sec = min(self.interval_sec, self.threshold_sec) / 2
+        while not self._stopped.wait(poll_sec):
+            beat = self._beat
+            overdue = time.monotonic() - self._beat_time - self.interval_sec
+            if overdue < self.threshold_sec:
+                continue
+            if self._captured is not None and self._captured[0] == beat:
+                continue # already have this one
+
+            frame = sys._current_frames().get(self._loop_thread_id, None)
+            if frame is None:
+                continue
+            stack = ''.join(traceback.format_stack(frame))
+            task = _current_task(self.loop)
+            self._captured = (beat, repr(task) if task is not None else None, stack)
+
+    @property
+    def stats(self):
+        return {'last_lag_sec' : self.last_lag_sec,
+                'max_lag_sec' : self.max_lag_sec,
+                'stalls' : self.stall_count}
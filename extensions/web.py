@@ -0,0 +1,73 @@
+import asyncio
+import logging
+
+import aiohttp # installed along with discord.py
+
+class WebError(Exception):
+    """ Raised when a request gets a response status other than 200. """
+
+    def __init__(self, url, status):
+        self.url = url
+        self.status = status
+        super().__init__('GET {0} returned {1}'.format(url, status))
+
+class WebClient(object):
+    """ A shared http client for extensions to use instead of blocking
+        libraries like requests.
+
+        Connections are kept alive and reused from a pool of at most
+        pool_size connections, and every request is cancelled after
+        timeout_sec seconds.
+    """
+
+    def __init__(self, loop, pool_size=10, timeout_sec=10):
+        self.loop = loop
+        self.pool_size = pool_size
+        self.timeout_sec = timeout_sec
+        self.logger = logging.getLogger('discord')
+        self._session = None
+
+    @property
+    def session(self):
+        """ The :class:`aiohttp.ClientSession`, created on first use. """
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.pool_size, loop=self.loop)
+            self._session = aiohttp.ClientSession(connector=connector, loop=self.loop)
+        return self._session
+
+    @asyncio.coroutine
+    def _get(self, url, params):
+        response = yield from self.session.get(url, params=params)
+        try:
+            if response.status != 200:
+                raise WebError(url, response.status)
+            data = yield from response.json()
+            return data
+        finally:
+            yield from response.release()
+
+    @asyncio.coroutine
+    def get_json(self, url, params=None):
+        """ Returns the decoded json body from a GET request to url.
+
+            Raises
+            -------
+            asyncio.TimeoutError
+                If the request takes longer than timeout_sec.
+            WebError
+                If the response status is not 200.
+            aiohttp.ClientError
+                If the connection fails.
+        """
+        data = yield from asyncio.wait_for(self._get(url, params), self.timeout_sec, loop=self.loop)
+        return data
+
+    @asyncio.coroutine
+    def close(self):
+        """ Closes every pooled connection. """
+        session = self._session
+        self._session = None
+        if session is not None and not session.closed:
+            closing = session.close() # only a coroutine in newer versions of aiohttp
+            if closing is not None:
+                yield from closing
@@ -0,0 +1,117 @@
+import copy
+import gzip
+import logging
+import logging.handlers
+import os
+import queue
+import shutil
+
+settings_filename = 'logging.json'
+log_format = '%(asctime)s:%(levelname)s:%(name)s: %(message)s'
+
+default_settings = {'description' : 'Settings for the bot\'s log file. Set \'when\' to one of'
+                                    ' \'midnight\', \'H\' or \'D\' to rotate by time instead of'
+                                    ' size. \'levels\' sets the level for each logger name.'
+                                    ' Changes are used on the next restart.',
+                    'max_bytes' : 10 * 1024 * 1024,
+                    'when' : None,
+                    'backup_count' : 5,
+                    'compress' : True,
+                    'levels' : {'discord' : 'INFO',
+                                'discord.gateway' : 'WARNING',
+                                'discord.http' : 'WARNING'}}
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """ Puts records on a queue for a :class:`logging.handlers.QueueListener`
+        to format and write on its own thread.
+    """
+
+    def __init__(self, log_queue, listener=None):
+        super().__init__(log_queue)
+        self.listener = listener
+
+    def prepare(self, record):
+        # only merge args into the message here, formatting (timestamps,
+        # tracebacks) is left to the listener thread
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def close(self):
+        # called by logging.shutdown, so queued records are written before
+        # the process exits or restarts
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
+        super().close()
+
+def _gzip_namer(name):
+    return name + '.gz'
+
+def _gzip_rotator(source, dest):
+    with open(source, 'rb') as f_in:
+        with gzip.open(dest, 'wb') as f_out:
+            shutil.copyfileobj(f_in, f_out)
+    os.remove(source)
+
+def _make_file_handler(log_filename, settings):
+    backup_count = settings.get('backup_count', default_settings['backup_count'])
+    when = settings.get('when', None)
+    if when:
+        handler = logging.handlers.TimedRotatingFileHandler(log_filename, when=when,
+                                                            backupCount=backup_count, encoding='utf-8')
+    else:
+        # appends, so the log is kept across restarts
+        handler = logging.handlers.RotatingFileHandler(log_filename, mode='a',
+                                                       maxBytes=settings.get('max_bytes', default_settings['max_bytes']),
+                                                       backupCount=backup_count, encoding='utf-8')
+    if settings.get('compress', True):
+        handler.namer = _gzip_namer
+        handler.rotator = _gzip_rotator
+    handler.setFormatter(logging.Formatter(log_format))
+    return handler
+
+def _parse_level(level):
+    """ Returns the level for a level name like 'info', or a number.
+        Raises ValueError or TypeError if it is neither.
+    """
+    if isinstance(level, bool):
+        raise TypeError('not a level: {!r}'.format(level))
+    if isinstance(level, int):
+        return level
+    return str(level).upper() # Logger.setLevel raises ValueError for unknown names
+
+def setup(log_filename, data_man, logger_name='discord'):
+    """ Sends everything logged to logger_name to log_filename, with the
+        file being written on a background thread and rotated according to
+        the settings in data/json/logging.json. Also sets the level of every
+        logger listed in those settings, skipping (and logging) any that are
+        not a valid level.
+
+        Returns the :class:`logging.handlers.QueueListener` doing the writing.
+    """
+    settings = data_man.load_json(settings_filename)
+    if not settings:
+        settings = default_settings
+        data_man.save_json(settings, settings_filename)
+
+    bad_levels = []
+    for name, level in settings.get('levels', {}).items():
+        try:
+            logging.getLogger(name).setLevel(_parse_level(level))
+        except (TypeError, ValueError):
+            bad_levels.append((name, level))
+
+    log_queue = queue.Queue(-1)
+    file_handler = _make_file_handler(log_filename, settings)
+    listener = logging.handlers.QueueListener(log_queue, file_handler)
+    queue_handler = _QueueHandler(log_queue, listener)
+    logger = logging.getLogger(logger_name)
+    logger.addHandler(queue_handler)
+    listener.start()
+
+    # logged once the file is set up, so they end up in it
+    for name, level in bad_levels:
+        logger.warning('Ignoring invalid level {0!r} for logger {1!r} in {2}'.format(level, name, settings_filename))
+    return listener
@@ -0,0 +1,62 @@
+""" Copies the json documents in data/json into the SQLite database used
+    when the bot runs with EMBERBOT_STORAGE=sqlite.
+
+    Usage::
+
+        python migrate_storage.py [--overwrite]
+
+    The json files are left where they are, so going back to files is just
+    a matter of unsetting EMBERBOT_STORAGE. Documents already in the
+    database are skipped unless --overwrite is given.
+"""
+
+import argparse
+import os
+import sys
+
+from extensions import data
+from extensions.data import JsonFileBackend, SQLiteBackend
+
+def migrate(source, target, overwrite=False, out=sys.stdout):
+    """ Copies every json document from source to target (backends).
+        Returns (copied, skipped, unreadable) lists of names.
+    """
+    existing = set(target.names())
+    copied, skipped, unreadable = [], [], []
+    for dirpath, dirnames, filenames in source.walk(source.directory):
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            name = os.path.relpath(path, source.directory).replace(os.sep, '/')
+            if name in existing and not overwrite:
+                skipped.append(name)
+                continue
+            obj = source.load(name)
+            if obj is None:
+                unreadable.append(name)
+                print('could not read {}, skipped'.format(name), file=out)
+                continue
+            target.save(obj, name)
+            copied.append(name)
+    target.flush()
+    return (copied, skipped, unreadable)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Copy data/json into the SQLite storage backend.')
+    parser.add_argument('--overwrite', action='store_true',
+                        help='replace documents that are already in the database')
+    args = parser.parse_args(argv)
+
+    source = JsonFileBackend()
+    target = SQLiteBackend(os.path.join(data.data_dir, data.sqlite_filename))
+    try:
+        copied, skipped, unreadable = migrate(source, target, overwrite=args.overwrite)
+    finally:
+        target.close()
+
+    print('copied {0} documents into {1} ({2} already there, {3} unreadable)'.format(
+        len(copied), target.path, len(skipped), len(unreadable)))
+    print('run the bot with {}=sqlite to use it'.format(data.storage_env_var))
+    return 1 if unreadable else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,3 +1,4 @@
+import logging
 import os
 import sys
 import time
@@ -17,6 +18,22 @@ def check_for_updates():
     git_cmd = git.cmd.Git(working_dir=working_dir)
     git_cmd.pull()
 
+def pull_changes():
+    """ Pulls like :func:`check_for_updates`, and returns a list of the
+        paths (relative to the repo root, with '/' separators) of every file
+        the pull changed.
+    """
+
+    working_dir = os.path.dirname(os.path.abspath(__file__))
+
+    git_cmd = git.cmd.Git(working_dir=working_dir)
+    old_head = git_cmd.rev_parse('HEAD')
+    git_cmd.pull()
+    new_head = git_cmd.rev_parse('HEAD')
+    if old_head == new_head:
+        return []
+    return [path for path in git_cmd.diff('--name-only', old_head, new_head).splitlines() if path]
+
 def restart(logger, seconds_before_restart=5):
     """ Waits a determined amount of time and then restarts
         this program.y
@@ -24,9 +41,12 @@ def restart(logger, seconds_before_restart=5):
     pre_wait_message = 'event loop has stopped... waiting {sec} seconds before restart'
     restarting_message = 'restarting bot...'
 
-    logger.debug(pre_wait_message.format(sec=seconds_before_restart))
+    logger.info(pre_wait_message.format(sec=seconds_before_restart))
     time.sleep(seconds_before_restart)
-    logger.debug(restarting_message)
+    logger.info(restarting_message)
+
+    # os.execl skips atexit, so write out any queued log records first
+    logging.shutdown()
 
     python = sys.executable
     os.execl(python, python, *sys.argv)
\ No newline at end of file
@@ -0,0 +1,354 @@
+""" Runs the bot as one worker process per shard, and keeps them running.
+
+    Usage::
+
+        python shard_supervisor.py --shards 8
+
+    The supervisor restarts workers that crash, gathers their health and
+    metrics into data/json/shards.json and data/metrics.prom, and does a
+    rolling restart of every worker (one at a time, waiting for each to be
+    ready again) when any shard runs the 'update' command.
+
+    Use ``--fake`` to run workers that pretend to be connected, for trying
+    out the supervisor without a bot token or a connection to discord.
+"""
+
+import argparse
+import asyncio
+import collections
+import logging
+import multiprocessing
+import os
+import queue
+import time
+
+from extensions import data
+from extensions.data import DataManager
+from extensions.metrics import Metrics
+
+health_filename = 'shards.json'
+metrics_filename = os.path.join(data.data_dir, 'metrics.prom')
+
+logger = logging.getLogger('emberbot.supervisor')
+
+class ShardLink(object):
+    """ A worker's connection to the supervisor, set as ``bot.supervisor``
+        on the worker's bot.
+    """
+
+    def __init__(self, shard_id, status_queue):
+        self.shard_id = shard_id
+        self.status_queue = status_queue
+
+    def send(self, kind, **info):
+        info.update(type=kind, worker=self.shard_id, time=time.time())
+        self.status_queue.put(info)
+
+    def request_update(self):
+        """ Asks the supervisor to pull updates and restart every worker. """
+        self.send('update')
+
+def run_worker(shard_id, token, shard_count, status_queue, conn, report_interval_sec=5, log_filename=None):
+    """ The entry point of a worker process. Runs a DiscordBot connected as
+        shard_id until the supervisor says to stop.
+
+        Every worker runs exactly one bot, since cogs, auto responses and
+        loaded extension modules are shared by everything in a process.
+    """
+    import bot as bot_module
+    from extensions.metrics import metrics
+
+    # every worker gets its own log file, since they can not share rotation
+    if log_filename is None:
+        log_filename = os.path.join(bot_module.working_dir, 'discord-shard{}.log'.format(shard_id))
+    bot_module.setup_logging(log_filename)
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    link = ShardLink(shard_id, status_queue)
+
+    bot = bot_module.DiscordBot(bot_module.get_command_prefix, description=bot_module.description,
+                                pm_help=False, default_command_prefix=bot_module.default_command_prefix,
+                                shard_id=shard_id, shard_count=shard_count, loop=loop)
+    bot.supervisor = link
+    bot.scheduler.cancel('dump_metrics') # the supervisor writes the combined metrics
+
+    @asyncio.coroutine
+    def report():
+        while True:
+            link.send('health',
+                      shard=shard_id,
+                      ready=bot.is_logged_in and bot.user is not None,
+                      servers=len(bot.servers),
+                      max_lag_sec=bot.watchdog.max_lag_sec)
+            link.send('metrics', snapshot=metrics.snapshot())
+            if conn.poll():
+                command = conn.recv()
+                if command == 'stop':
+                    yield from bot.logout()
+                    return
+            yield from asyncio.sleep(report_interval_sec, loop=loop)
+
+    tasks = [loop.create_task(t) for t in (bot.start(token), bot.watchdog.run(), report())]
+    try:
+        # stops as soon as report() returns, or anything fails
+        loop.run_until_complete(asyncio.wait(tasks, loop=loop, return_when=asyncio.FIRST_COMPLETED))
+    finally:
+        if not bot.is_closed:
+            loop.run_until_complete(bot.logout())
+        for task in tasks:
+            task.cancel()
+        loop.run_until_complete(asyncio.gather(*tasks, loop=loop, return_exceptions=True))
+        bot.data_man.flush()
+        loop.close()
+
+def run_fake_worker(shard_id, token, shard_count, status_queue, conn, report_interval_sec=1):
+    """ Stands in for :func:`run_worker` without connecting to discord.
+        Reports itself ready with made up metrics, and stops when told to.
+    """
+    from extensions.metrics import Metrics
+    fake_metrics = Metrics()
+    link = ShardLink(shard_id, status_queue)
+    started = time.time()
+    while True:
+        fake_metrics.observe('command', 'ping', 0.001 * (shard_id + 1))
+        link.send('health', shard=shard_id, ready=time.time() - started > 0.5,
+                  servers=10, max_lag_sec=0.0)
+        link.send('metrics', snapshot=fake_metrics.snapshot())
+        if conn.poll(report_interval_sec):
+            if conn.recv() == 'stop':
+                return
+
+class Worker(object):
+    """ The supervisor's handle on one worker process. """
+
+    def __init__(self, shard_id):
+        self.shard_id = shard_id
+        self.process = None
+        self.conn = None
+        self.started = 0
+        self.restarts = 0
+        self.crashes = 0 # since it last ran long enough to count as stable
+        self.next_start = 0 # for backing off after crashes
+        self.stopping = False
+        self.health = {}
+        self.snapshot = []
+
+    @property
+    def alive(self):
+        return self.process is not None and self.process.is_alive()
+
+    @property
+    def ready(self):
+        return self.alive and self.health.get('ready', False) and self.health.get('time', 0) >= self.started
+
+class ShardSupervisor(object):
+    """ Starts, watches and restarts the worker processes.
+
+        Attributes
+        -----------
+        workers : list
+            A :class:`Worker` for each worker process.
+    """
+
+    stop_timeout_sec = 30 # time a worker gets to log out before it is killed
+    ready_timeout_sec = 300 # time a restarted worker gets to be ready during a rolling restart
+    stable_after_sec = 300 # a worker running this long has its crash count reset
+    max_backoff_sec = 60
+    write_interval_sec = 15 # how often health and metrics are written
+
+    def __init__(self, token, shard_count, worker_target=run_worker, pull_updates=True):
+        self.token = token
+        self.shard_count = shard_count
+        self.worker_target = worker_target
+        self.pull_updates = pull_updates
+        # workers are spawned, not forked, so they do not inherit open files
+        # and connections (like the sqlite backend's) from the supervisor
+        self._context = multiprocessing.get_context('spawn')
+        self.status_queue = self._context.Queue()
+        self.workers = [Worker(shard_id) for shard_id in range(shard_count)]
+        self.data_man = DataManager()
+        self._rolling = collections.deque() # workers still waiting for a rolling restart
+        self._rolling_current = None
+        self._rolling_started = 0
+        self._last_write = 0
+        self._stopped = False
+
+    def start_worker(self, worker):
+        parent_conn, child_conn = self._context.Pipe()
+        worker.process = self._context.Process(
+            target=self.worker_target, name='emberbot-shard-{}'.format(worker.shard_id),
+            args=(worker.shard_id, self.token, self.shard_count, self.status_queue, child_conn))
+        worker.conn = parent_conn
+        worker.stopping = False
+        worker.health = {}
+        worker.started = time.time()
+        worker.process.start()
+        logger.info('started worker for shard {0} (pid {1})'.format(worker.shard_id, worker.process.pid))
+
+    def stop_worker(self, worker):
+        """ Asks a worker to log out, killing it if it takes too long. """
+        if not worker.alive:
+            return
+        worker.stopping = True
+        try:
+            worker.conn.send('stop')
+        except (BrokenPipeError, EOFError, OSError):
+            pass
+        worker.process.join(self.stop_timeout_sec)
+        if worker.process.is_alive():
+            logger.warning('worker for shard {} did not stop in time, terminating it'.format(worker.shard_id))
+            worker.process.terminate()
+            worker.process.join()
+
+    def rolling_restart(self):
+        """ Pulls updates, then restarts workers one at a time, waiting for
+            each one to be ready before restarting the next.
+        """
+        if self._rolling or self._rolling_current is not None:
+            return # already doing one
+        if self.pull_updates:
+            import self_updater
+            self_updater.check_for_updates()
+        logger.info('starting rolling restart')
+        self._rolling.extend(self.workers)
+
+    def _step_rolling_restart(self):
+        now = time.time()
+        current = self._rolling_current
+        if current is not None:
+            if current.ready or now - self._rolling_started > self.ready_timeout_sec:
+                if not current.ready:
+                    logger.warning('worker for shard {} was not ready in time, moving on'.format(current.shard_id))
+                self._rolling_current = None
+            else:
+                return
+        if self._rolling:
+            current = self._rolling.popleft()
+            self._rolling_current = current
+            self._rolling_started = now
+            self.stop_worker(current)
+            current.restarts += 1
+            self.start_worker(current)
+        elif current is not None:
+            logger.info('rolling restart finished')
+
+    def _check_workers(self):
+        """ Restarts workers that have exited without being told to, backing
+            off if they keep crashing.
+        """
+        now = time.time()
+        for worker in self.workers:
+            if worker.alive or worker.stopping or worker is self._rolling_current:
+                continue
+            if worker.process is not None and worker.next_start == 0:
+                if now - worker.started >= self.stable_after_sec:
+                    worker.crashes = 0
+                worker.crashes += 1
+                backoff = min(self.max_backoff_sec, 2 ** (worker.crashes - 1))
+                worker.next_start = now + backoff
+                logger.warning('worker for shard {0} exited with code {1}, restarting in {2}s'.format(
+                    worker.shard_id, worker.process.exitcode, backoff))
+            if now >= worker.next_start:
+                worker.next_start = 0
+                worker.restarts += 1
+                self.start_worker(worker)
+
+    def _handle_status(self, status):
+        worker = self.workers[status['worker']]
+        kind = status['type']
+        if kind == 'health':
+            worker.health = status
+        elif kind == 'metrics':
+            worker.snapshot = status['snapshot']
+        elif kind == 'update':
+            logger.info('shard {} requested an update'.format(worker.shard_id))
+            self.rolling_restart()
+
+    def health(self):
+        """ Returns a dict with the health of every worker. """
+        return {'shard_count' : self.shard_count,
+                'workers' : [{'shard' : w.shard_id,
+                              'pid' : w.process.pid if w.process is not None else None,
+                              'alive' : w.alive,
+                              'ready' : w.ready,
+                              'servers' : w.health.get('servers', 0),
+                              'max_lag_sec' : w.health.get('max_lag_sec', 0.0),
+                              'restarts' : w.restarts,
+                              'last_report' : w.health.get('time', None)}
+                             for w in self.workers]}
+
+    def metrics(self):
+        """ Returns a :class:`extensions.metrics.Metrics` with the metrics of
+            every worker added together.
+        """
+        combined = Metrics()
+        for worker in self.workers:
+            combined.merge(worker.snapshot)
+        return combined
+
+    def write_reports(self):
+        self.data_man.save_json(self.health(), health_filename)
+        data.atomic_write(metrics_filename, self.metrics().prometheus_text().encode('utf-8'))
+
+    def poll(self, timeout_sec=1.0):
+        """ Does one round of supervising: handles status reports (waiting up
+            to timeout_sec for the first), restarts workers and writes reports.
+        """
+        try:
+            status = self.status_queue.get(timeout=timeout_sec)
+            while True:
+                self._handle_status(status)
+                status = self.status_queue.get_nowait()
+        except queue.Empty:
+            pass
+
+        self._step_rolling_restart()
+        self._check_workers()
+        if time.time() - self._last_write >= self.write_interval_sec:
+            self._last_write = time.time()
+            self.write_reports()
+
+    def run(self):
+        """ Starts every worker and supervises them until interrupted. """
+        for worker in self.workers:
+            self.start_worker(worker)
+        try:
+            while not self._stopped:
+                self.poll()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
+
+    def stop(self):
+        self._stopped = True
+        for worker in self.workers:
+            self.stop_worker(worker)
+        self.data_man.flush()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run the bot as several sharded worker processes.')
+    parser.add_argument('--shards', type=int, required=True, help='total number of shards')
+    parser.add_argument('--fake', action='store_true',
+                        help='run fake workers that do not connect to discord')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s:%(levelname)s:%(name)s: %(message)s')
+
+    if args.fake:
+        token = None
+        target = run_fake_worker
+    else:
+        import dependencies
+        dependencies.install()
+        import secret
+        token = secret.botToken
+        target = run_worker
+
+    supervisor = ShardSupervisor(token, args.shards, worker_target=target,
+                                 pull_updates=not args.fake)
+    supervisor.run()
+
+if __name__ == '__main__':
+    main()
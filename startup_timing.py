@@ -0,0 +1,37 @@
+""" Records how long each phase of starting the bot takes. """
+
+import logging
+import time
+
+_start = time.monotonic()
+_last = _start
+_phases = [] # (name, seconds)
+_finished = False
+
+def mark(name):
+    """ Ends the current phase, naming it name. Does nothing once
+        :func:`finish` has been called.
+    """
+    global _last
+    if _finished:
+        return
+    now = time.monotonic()
+    _phases.append((name, now - _last))
+    _last = now
+
+def phases():
+    return list(_phases)
+
+def finish(logger=None):
+    """ Logs how long every phase took, once. Returns the total seconds. """
+    global _finished
+    if _finished:
+        return None
+    _finished = True
+
+    logger = logger or logging.getLogger('discord')
+    total = sum(seconds for name, seconds in _phases)
+    logger.info('startup took {0:.2f}s'.format(total))
+    for name, seconds in _phases:
+        logger.info('  {0:<16} {1:6.2f}s ({2:.0%})'.format(name, seconds, seconds / total if total else 0))
+    return total
@@ -0,0 +1,92 @@
+import asyncio
+import os
+import sys
+import types
+import unittest
+
+from aiohttp import web
+
+project_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_dir)
+
+from extensions.fun import Fun
+from extensions.web import WebClient
+
+class JokePrefetchTest(unittest.TestCase):
+    """ Serves fake jokes from a local aiohttp server, and checks that the
+        joke buffer is filled ahead of time and refilled as it runs low.
+    """
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.requested = [] # the count of every request
+        self.next_joke = 0
+
+        @asyncio.coroutine
+        def jokes(request):
+            count = int(request.match_info['count'])
+            self.requested.append(count)
+            value = []
+            for _ in range(count):
+                value.append({'id' : self.next_joke, 'joke' : 'joke {}'.format(self.next_joke)})
+                self.next_joke += 1
+            return web.json_response({'type' : 'success', 'value' : value})
+
+        self.app = web.Application(loop=self.loop)
+        self.app.router.add_route('GET', '/jokes/random/{count}', jokes)
+        self.handler = self.app.make_handler()
+        self.server = self.loop.run_until_complete(self.loop.create_server(self.handler, '127.0.0.1', 0))
+        port = self.server.sockets[0].getsockname()[1]
+
+        self.old_url = Fun.chuck_norris_url
+        Fun.chuck_norris_url = 'http://127.0.0.1:{}/jokes/random/{{count}}'.format(port)
+
+        self.said = []
+
+        @asyncio.coroutine
+        def say(content):
+            self.said.append(content)
+
+        self.bot = types.SimpleNamespace(loop=self.loop, data_man=None, say=say,
+                                         web_client=WebClient(self.loop))
+
+    def tearDown(self):
+        Fun.chuck_norris_url = self.old_url
+        self.loop.run_until_complete(self.bot.web_client.close())
+        self.server.close()
+        self.loop.run_until_complete(self.server.wait_closed())
+        self.loop.run_until_complete(self.app.shutdown())
+        self.loop.run_until_complete(self.handler.finish_connections(1.0))
+        self.loop.run_until_complete(self.app.cleanup())
+        self.loop.close()
+
+    def test_prefetches_and_refills(self):
+        fun = Fun(self.bot)
+        self.loop.run_until_complete(fun._joke_refill)
+        self.assertEqual(self.requested, [Fun.joke_buffer_size])
+        self.assertEqual(list(fun.jokes), ['joke {}'.format(i) for i in range(Fun.joke_buffer_size)])
+
+        # telling jokes down to joke_refill_at starts fetching more
+        for _ in range(Fun.joke_buffer_size - Fun.joke_refill_at):
+            self.loop.run_until_complete(Fun.chucknorris.callback(fun))
+        self.assertEqual(len(self.said), Fun.joke_buffer_size - Fun.joke_refill_at)
+        self.assertEqual(self.said[0], '[**Chuck**] joke 0')
+        self.assertIsNotNone(fun._joke_refill)
+
+        self.loop.run_until_complete(fun._joke_refill)
+        self.assertEqual(self.requested, [Fun.joke_buffer_size, Fun.joke_buffer_size - Fun.joke_refill_at])
+        self.assertEqual(len(fun.jokes), Fun.joke_buffer_size)
+        self.assertEqual(fun.jokes[-1], 'joke {}'.format(self.next_joke - 1))
+
+    def test_empty_buffer_waits_for_refill(self):
+        fun = Fun(self.bot)
+        self.loop.run_until_complete(fun._joke_refill)
+        fun.jokes.clear()
+
+        self.loop.run_until_complete(Fun.chucknorris.callback(fun))
+        self.assertEqual(self.said, ['[**Chuck**] joke {}'.format(Fun.joke_buffer_size)])
+        self.assertEqual(self.requested, [Fun.joke_buffer_size, Fun.joke_buffer_size])
+
+if __name__ == '__main__':
+    unittest.main()
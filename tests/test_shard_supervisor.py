@@ -0,0 +1,126 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import queue
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+project_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_dir)
+
+from extensions import data
+import shard_supervisor
+
+class RunWorkerTest(unittest.TestCase):
+    """ Runs the real worker entry point in this process, with the bot's
+        connection to discord stubbed out.
+    """
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp(prefix='emberbot-test-')
+        self.old_dirs = (data.json_dir, data.pickle_dir)
+        data.json_dir = os.path.join(self.temp_dir, 'json')
+        data.pickle_dir = os.path.join(self.temp_dir, 'pickled')
+        os.makedirs(data.json_dir)
+        os.makedirs(data.pickle_dir)
+        self.log_filename = os.path.join(self.temp_dir, 'discord-shard1.log')
+        self.old_handlers = list(logging.getLogger('discord').handlers)
+
+        import bot as bot_module
+        self.bot_class = bot_module.DiscordBot
+        self.started = []
+        started = self.started
+
+        @asyncio.coroutine
+        def start(bot, token):
+            started.append((bot, token))
+            while not bot.is_closed: # like a connection, until logged out
+                yield from asyncio.sleep(0.01, loop=bot.loop)
+
+        self.old_start = self.bot_class.start
+        self.bot_class.start = start
+
+    def tearDown(self):
+        self.bot_class.start = self.old_start
+        data.json_dir, data.pickle_dir = self.old_dirs
+        discord_logger = logging.getLogger('discord')
+        for handler in [h for h in discord_logger.handlers if h not in self.old_handlers]:
+            discord_logger.removeHandler(handler)
+            handler.close()
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def test_runs_one_bot_until_stopped(self):
+        status_queue = queue.Queue()
+        parent_conn, child_conn = multiprocessing.Pipe()
+        parent_conn.send('stop')
+
+        shard_supervisor.run_worker(1, 'token', 2, status_queue, child_conn, report_interval_sec=0.01,
+                                    log_filename=self.log_filename)
+
+        self.assertEqual(len(self.started), 1)
+        bot, token = self.started[0]
+        self.assertEqual(token, 'token')
+        self.assertEqual((bot.shard_id, bot.shard_count), (1, 2))
+        self.assertIs(bot.supervisor.status_queue, status_queue)
+        self.assertNotIn('dump_metrics', bot.scheduler.jobs)
+        self.assertTrue(bot.is_closed)
+        self.assertTrue(bot.loop.is_closed())
+        self.assertTrue(os.path.exists(self.log_filename))
+
+        statuses = []
+        while not status_queue.empty():
+            statuses.append(status_queue.get_nowait())
+        health = [s for s in statuses if s['type'] == 'health']
+        self.assertTrue(health)
+        self.assertEqual(health[0]['shard'], 1)
+        self.assertEqual(health[0]['worker'], 1)
+        self.assertFalse(health[0]['ready'])
+        self.assertTrue(any(s['type'] == 'metrics' for s in statuses))
+
+class SupervisorTest(unittest.TestCase):
+    """ Runs the supervisor with fake worker processes. """
+
+    def setUp(self):
+        # keep reports out of the real data dir
+        self.temp_dir = tempfile.mkdtemp(prefix='emberbot-test-')
+        self.old_paths = (data.json_dir, shard_supervisor.metrics_filename)
+        data.json_dir = self.temp_dir
+        shard_supervisor.metrics_filename = os.path.join(self.temp_dir, 'metrics.prom')
+        self.supervisor = shard_supervisor.ShardSupervisor(None, 2, worker_target=shard_supervisor.run_fake_worker,
+                                                           pull_updates=False)
+
+    def tearDown(self):
+        self.supervisor.stop()
+        data.json_dir, shard_supervisor.metrics_filename = self.old_paths
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def poll_until(self, condition, timeout_sec=10):
+        deadline = time.time() + timeout_sec
+        while time.time() < deadline:
+            self.supervisor.poll(0.1)
+            if condition():
+                return True
+        return False
+
+    def test_restarts_crashed_worker(self):
+        for worker in self.supervisor.workers:
+            self.supervisor.start_worker(worker)
+        self.assertTrue(self.poll_until(lambda: all(w.ready for w in self.supervisor.workers)))
+
+        crashed = self.supervisor.workers[0]
+        crashed.process.terminate()
+        crashed.process.join()
+        self.assertTrue(self.poll_until(lambda: crashed.restarts == 1 and crashed.ready))
+
+        health = self.supervisor.health()
+        self.assertEqual([w['shard'] for w in health['workers']], [0, 1])
+        self.assertTrue(self.supervisor.metrics().summary_lines('command'))
+        self.assertTrue(os.path.exists(os.path.join(self.temp_dir, shard_supervisor.health_filename)))
+        self.assertTrue(os.path.exists(shard_supervisor.metrics_filename))
+
+if __name__ == '__main__':
+    unittest.main()